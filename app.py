@@ -2,11 +2,29 @@ from dotenv import load_dotenv
 import os
 import re
 import time
-from flask import Flask, request, render_template, jsonify, redirect, url_for, send_file
+from flask import Flask, Response, g, request, render_template, jsonify, redirect, url_for, send_file
 import requests
 import json
+import click
+import jwt
+import random
 import logging
+import sqlite3
+import hashlib
+import hmac
+import contextvars
+import difflib
+import threading
+import unicodedata
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
+from urllib.parse import quote, urlparse
+from requests.adapters import HTTPAdapter
 
 # Configuration du logging améliorée
 logging.basicConfig(level=logging.INFO, 
@@ -23,14 +41,158 @@ JIRA_EMAIL = os.getenv("JIRA_EMAIL")
 JIRA_API_TOKEN = os.getenv("JIRA_API_TOKEN")
 JIRA_PROJECT_KEY = os.getenv("JIRA_PROJECT_KEY", "ACD")
 API_URL = os.getenv("API_URL", "https://classics-funeral-denial-reserved.trycloudflare.com/v1/chat/completions")
+LLM_MODEL = os.getenv("LLM_MODEL", "mistral-7b-instruct-v0.3")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+
+# Résilience des appels LLM : retries, délai global par requête et disjoncteur
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "10"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "180"))
+# Échéances propagées à tous les appels Jira / LLM : par requête HTTP et par génération complète
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "60"))
+GENERATION_DEADLINE = float(os.getenv("GENERATION_DEADLINE", "300"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_RESET_TIMEOUT = float(os.getenv("LLM_BREAKER_RESET_TIMEOUT", "30"))
+# Sondage de santé des backends LLM (secondes, 0 pour désactiver) ; les backends eux-mêmes
+# se configurent via LLM_BACKENDS (voir load_llm_backends)
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "30"))
+# Budget de tokens de réponse, ajusté à la taille de la user story et au format demandé
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "8192"))
+LLM_MAX_TOKENS_MIN = int(os.getenv("LLM_MAX_TOKENS_MIN", "256"))
+LLM_MAX_TOKENS_MAX = int(os.getenv("LLM_MAX_TOKENS_MAX", "1536"))
+LLM_MAX_CONTINUATIONS = int(os.getenv("LLM_MAX_CONTINUATIONS", "2"))
 APP_BASE_URL = os.getenv("APP_BASE_URL", "https://qalilab-ai.onrender.com")
 
+# Paramètres du client HTTP Jira (pool de connexions et timeouts par défaut)
+JIRA_POOL_SIZE = int(os.getenv("JIRA_POOL_SIZE", "10"))
+JIRA_CONNECT_TIMEOUT = float(os.getenv("JIRA_CONNECT_TIMEOUT", "5"))
+JIRA_READ_TIMEOUT = float(os.getenv("JIRA_READ_TIMEOUT", "30"))
+
+# Traçage des requêtes : nombre de traces gardées en mémoire et fichier JSONL optionnel
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+# Cache des types d'issues : durée de fraîcheur, puis durée pendant laquelle
+# une valeur périmée est encore servie pendant son rafraîchissement en arrière-plan
+ISSUE_TYPES_CACHE_TTL = int(os.getenv("ISSUE_TYPES_CACHE_TTL", "3600"))
+ISSUE_TYPES_STALE_TTL = int(os.getenv("ISSUE_TYPES_STALE_TTL", "86400"))
+# Cache des user stories lues par le panneau (revalidé sur le champ "updated" de l'issue)
+ISSUE_CACHE_SIZE = int(os.getenv("ISSUE_CACHE_SIZE", "512"))
+# Tickets de test créés à partir des scénarios générés
+TEST_ISSUE_TYPE = os.getenv("TEST_ISSUE_TYPE", "Test")
+TEST_LINK_TYPE = os.getenv("TEST_LINK_TYPE", "Relates")
+JIRA_BULK_CREATE_SIZE = 50  # Limite de l'API issue/bulk par appel
+
+# Jobs de génération asynchrones
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+JOB_TTL = int(os.getenv("JOB_TTL", "3600"))
+# Un job que plus aucun client ne suit depuis ce délai (secondes) est annulé, 0 pour désactiver
+JOB_ABANDON_TIMEOUT = float(os.getenv("JOB_ABANDON_TIMEOUT", "60"))
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH")  # Persistance SQLite optionnelle
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+
+# Cache des cas de test générés (LRU mémoire + SQLite optionnel, "" pour désactiver le disque)
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "256"))
+GENERATION_CACHE_DB = os.getenv("GENERATION_CACHE_DB", "generation_cache.db")
+GENERATION_CACHE_MAX_BYTES = int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+# Historique des générations par issue (SQLite en mode WAL, "" pour désactiver)
+GENERATION_HISTORY_DB = os.getenv("GENERATION_HISTORY_DB", "generation_history.db")
+GENERATION_HISTORY_MAX_VERSIONS = int(os.getenv("GENERATION_HISTORY_MAX_VERSIONS", "50"))
+# Contenu écrit dans la description Jira : "replace" (dernière suite seulement, sous la user story),
+# "link" (lien vers la version dans l'historique) ou "append" (ajout à la suite des précédentes)
+JIRA_STORY_UPDATE_MODE = os.getenv("JIRA_STORY_UPDATE_MODE", "replace").lower()
+# Contrôle d'admission devant le backend LLM
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "16"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+
+# Génération en masse sur une requête JQL
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "4"))
+BULK_PAGE_SIZE = int(os.getenv("BULK_PAGE_SIZE", "50"))
+
+# À incrémenter à chaque modification du post-traitement des réponses pour invalider le cache
+# (les templates de prompt ont leur propre version, voir PromptRegistry)
+PROMPT_TEMPLATE_VERSION = "3"
+PROMPT_TEMPLATE_PINS = os.getenv("PROMPT_TEMPLATE_PINS", "")
+LLM_SYSTEM_ROLE = os.getenv("LLM_SYSTEM_ROLE", "true").lower() == "true"
+
+# Pré-génération déclenchée par les webhooks Jira (création / modification de user stories)
+PREGENERATION_ENABLED = os.getenv("PREGENERATION_ENABLED", "true").lower() == "true"
+PREGENERATION_ISSUE_TYPES = [t.strip().lower() for t in os.getenv("PREGENERATION_ISSUE_TYPES", "Story,Récit,User Story").split(",") if t.strip()]
+PREGENERATION_FORMATS = [f.strip() for f in os.getenv("PREGENERATION_FORMATS", "gherkin").split(",") if f.strip()]
+PREGENERATION_LANGUAGE = os.getenv("PREGENERATION_LANGUAGE", "fr")
+PREGENERATION_DEBOUNCE = float(os.getenv("PREGENERATION_DEBOUNCE", "30"))
+PREGENERATION_MAX_PENDING = int(os.getenv("PREGENERATION_MAX_PENDING", "500"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Installations Atlassian Connect (clientKey, sharedSecret) : vérification du JWT des webhooks de l'add-on
+CONNECT_DB_PATH = os.getenv("CONNECT_DB_PATH", "connect_installations.db")
+# Clés publiques d'Atlassian pour les appels de cycle de vie signés (signed install, RS256)
+CONNECT_INSTALL_KEYS_URL = os.getenv("CONNECT_INSTALL_KEYS_URL", "https://connect-install-keys.atlassian.com")
+
 logger.info(f"Démarrage de l'application QaliLab AI")
 logger.info(f"URL de base de l'application: {APP_BASE_URL}")
 logger.info(f"URL de base Jira: {JIRA_BASE_URL}")
 
 app = Flask(__name__)
 
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.time()
+    metrics.inc("http_requests_in_flight")
+
+@app.after_request
+def record_request_metrics(response):
+    """Mesure la durée de traitement (pour les réponses en streaming : jusqu'à l'envoi des en-têtes)"""
+    route = request.url_rule.rule if request.url_rule else "non_trouvee"
+    metrics.inc("http_requests_total", route=route, method=request.method, status=response.status_code)
+    if "request_started" in g:
+        metrics.observe("http_request_duration_seconds", time.time() - g.request_started,
+                        route=route, method=request.method)
+    return response
+
+@app.teardown_request
+def end_request_metrics(error=None):
+    if g.pop("request_started", None) is not None:
+        metrics.inc("http_requests_in_flight", -1)
+
+# Routes d'observabilité exclues du traçage
+UNTRACED_PATHS = ("/metrics", "/debug/traces")
+
+@app.before_request
+def start_request_trace():
+    if request.path in UNTRACED_PATHS:
+        return
+    # L'identifiant de requête fourni par l'appelant est réutilisé comme identifiant de trace
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    g.trace_span, g.trace_token = tracer.start(f"{request.method} {request.path}", trace_id=request_id,
+                                               method=request.method, path=request.path)
+
+@app.after_request
+def add_request_id_header(response):
+    if "trace_span" in g:
+        g.trace_span["attributes"]["status"] = response.status_code
+        response.headers["X-Request-ID"] = g.trace_span["trace_id"]
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    span = g.pop("trace_span", None)
+    if span is not None:
+        tracer.finish(span, g.pop("trace_token"), error)
+
+@app.before_request
+def start_request_deadline():
+    # Échéance de la requête, transmise comme timeout aux appels Jira qu'elle déclenche
+    g.deadline_token = _current_deadline.set(Deadline(REQUEST_DEADLINE, reason="hors délai"))
+
+@app.teardown_request
+def end_request_deadline(error=None):
+    token = g.pop("deadline_token", None)
+    if token is not None:
+        _current_deadline.reset(token)
+
 # Ajouter les headers CORS et de sécurité à toutes les réponses
 @app.after_request
 def add_headers(response):
@@ -45,29 +207,836 @@ def add_headers(response):
     
     return response
 
-def generate_response(prompt, max_tokens=206):
+class Metrics:
+    """Registre minimal de métriques au format texte Prometheus (compteurs, jauges, histogrammes).
+
+    Les valeurs sont propres à chaque processus worker.
+    """
+
+    DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._descriptions = {}
+        self._values = {}
+        self._histograms = {}
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        self._descriptions[name] = (metric_type, help_text, buckets or self.DEFAULT_BUCKETS)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self._descriptions[name][2]
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.setdefault(key, {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def track(self, histogram, in_flight=None, **labels):
+        """Mesure la durée d'un bloc (et le compte dans la jauge in_flight pendant son exécution)"""
+        if in_flight:
+            self.inc(in_flight, **labels)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(histogram, time.time() - start, **labels)
+            if in_flight:
+                self.inc(in_flight, -1, **labels)
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = [(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: dict(h, buckets=list(h["buckets"])) for key, h in self._histograms.items()}
+        lines = []
+        for name, (metric_type, help_text, buckets) in sorted(self._descriptions.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "histogram":
+                for (metric, labels), h in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(buckets, h["buckets"]):
+                        lines.append(f"{name}_bucket{self._format_labels(labels, [('le', str(bound))])} {count}")
+                    lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {h['count']}")
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {h['sum']}")
+                    lines.append(f"{name}_count{self._format_labels(labels)} {h['count']}")
+            else:
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{self._format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("http_requests_total", "counter", "Requêtes HTTP traitées par route, méthode et statut")
+metrics.describe("http_request_duration_seconds", "histogram", "Durée de traitement des requêtes HTTP par route")
+metrics.describe("http_requests_in_flight", "gauge", "Requêtes HTTP en cours de traitement")
+metrics.describe("jira_requests_total", "counter", "Appels à l'API Jira par opération et statut")
+metrics.describe("jira_request_duration_seconds", "histogram", "Durée des appels à l'API Jira par opération")
+metrics.describe("jira_requests_in_flight", "gauge", "Appels à l'API Jira en cours par opération")
+metrics.describe("llm_requests_total", "counter", "Appels HTTP au backend LLM par backend et statut")
+metrics.describe("llm_request_duration_seconds", "histogram", "Durée des appels au backend LLM (réponse complète)")
+metrics.describe("llm_requests_in_flight", "gauge", "Appels au backend LLM en cours")
+metrics.describe("llm_prompt_tokens_total", "counter", "Tokens de prompt consommés (champ usage du LLM)")
+metrics.describe("llm_completion_tokens_total", "counter", "Tokens générés (champ usage du LLM)")
+metrics.describe("llm_prompt_cached_tokens_total", "counter", "Tokens de prompt servis par le cache de préfixe du serveur")
+metrics.describe("llm_admission_active", "gauge", "Appels LLM admis en cours d'exécution")
+metrics.describe("llm_admission_waiting", "gauge", "Appels LLM en file d'attente")
+metrics.describe("llm_admission_rejected_total", "counter", "Appels LLM refusés par le contrôle d'admission")
+metrics.describe("generation_jobs_pending", "gauge", "Jobs de génération en attente d'un worker")
+metrics.describe("llm_continuations_total", "counter", "Demandes de suite après une réponse tronquée")
+metrics.describe("pregeneration_pending", "gauge", "Issues en attente de pré-génération")
+metrics.describe("pregenerations_total", "counter", "Pré-générations traitées par résultat")
+metrics.describe("generations_cancelled_total", "counter", "Générations annulées (client parti, job abandonné)")
+metrics.describe("generation_repairs_total", "counter", "Réponses Gherkin réparées localement, par problème")
+
+def record_llm_usage(usage, model=None):
+    """Comptabilise les tokens du champ usage d'une réponse LLM, par modèle ayant servi l'appel"""
+    if usage:
+        model = model or LLM_MODEL
+        metrics.inc("llm_prompt_tokens_total", usage.get("prompt_tokens") or 0, model=model)
+        metrics.inc("llm_completion_tokens_total", usage.get("completion_tokens") or 0, model=model)
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        if cached:
+            metrics.inc("llm_prompt_cached_tokens_total", cached, model=model)
+
+# Span en cours dans le contexte d'exécution (requête Flask, job, thread)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Tracer:
+    """Traçage léger : chaque requête (ou job) forme une trace composée de spans imbriqués.
+
+    Les traces terminées sont conservées dans un tampon circulaire en mémoire et, si file_path
+    est défini, ajoutées à un fichier JSONL. Aucun collecteur externe n'est nécessaire.
+    """
+
+    def __init__(self, buffer_size=200, file_path=None):
+        self.file_path = file_path
+        self._traces = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current_trace_id():
+        span = _current_span.get()
+        return span["trace_id"] if span else None
+
+    def start(self, name, trace_id=None, **attributes):
+        """Ouvre un span enfant du span courant (ou un nouveau span racine). Retourne (span, token)."""
+        parent = _current_span.get()
+        span = {
+            "trace_id": parent["trace_id"] if parent else (trace_id or uuid.uuid4().hex),
+            "span_id": uuid.uuid4().hex[:16],
+            "parent_id": parent["span_id"] if parent else None,
+            "name": name,
+            "start": time.time(),
+            "attributes": attributes,
+            "status": "ok",
+            # Liste partagée des spans terminés de la trace, portée par le span racine
+            "_spans": parent["_spans"] if parent else []
+        }
+        return span, _current_span.set(span)
+
+    def finish(self, span, token, error=None):
+        span["duration_ms"] = round((time.time() - span["start"]) * 1000, 1)
+        if error is not None:
+            span["status"] = "error"
+            span["attributes"]["error"] = str(error)
+        _current_span.reset(token)
+        spans = span.pop("_spans")
+        spans.append(span)
+        if span["parent_id"] is None:
+            self._export(span, spans)
+
+    @contextmanager
+    def span(self, name, trace_id=None, **attributes):
+        span, token = self.start(name, trace_id=trace_id, **attributes)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.finish(span, token, error)
+
+    def _export(self, root, spans):
+        trace = {
+            "trace_id": root["trace_id"],
+            "name": root["name"],
+            "start": datetime.fromtimestamp(root["start"]).isoformat(),
+            "duration_ms": root["duration_ms"],
+            "status": "error" if any(s["status"] == "error" for s in spans) else "ok",
+            "spans": [
+                {
+                    "span_id": s["span_id"],
+                    "parent_id": s["parent_id"],
+                    "name": s["name"],
+                    "offset_ms": round((s["start"] - root["start"]) * 1000, 1),
+                    "duration_ms": s["duration_ms"],
+                    "status": s["status"],
+                    "attributes": s["attributes"]
+                }
+                for s in sorted(spans, key=lambda s: s["start"])
+            ]
+        }
+        with self._lock:
+            self._traces.append(trace)
+            if self.file_path:
+                try:
+                    with open(self.file_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(trace, ensure_ascii=False, default=str) + "\n")
+                except Exception as e:
+                    logger.error(f"Erreur lors de l'écriture de la trace: {str(e)}")
+
+    def recent(self, trace_id=None, min_duration_ms=0, limit=50):
+        """Dernières traces, les plus récentes en premier"""
+        with self._lock:
+            traces = list(self._traces)
+        traces = [t for t in reversed(traces)
+                  if (not trace_id or t["trace_id"] == trace_id) and t["duration_ms"] >= min_duration_ms]
+        return traces[:limit]
+
+tracer = Tracer(buffer_size=TRACE_BUFFER_SIZE, file_path=TRACE_FILE)
+
+def format_trace(trace):
+    """Représentation texte d'une trace sous forme de chronologie"""
+    depth = {None: -1}
+    lines = [f"{trace['start']}  {trace['name']}  {trace['duration_ms']}ms  [{trace['trace_id']}]"]
+    for span in trace["spans"]:
+        depth[span["span_id"]] = depth.get(span["parent_id"], 0) + 1
+        attributes = " ".join(f"{k}={v}" for k, v in span["attributes"].items())
+        lines.append(f"  +{span['offset_ms']:>8}ms {span['duration_ms']:>8}ms  "
+                     f"{'  ' * depth[span['span_id']]}{span['name']} {attributes}".rstrip())
+    return "\n".join(lines)
+
+class OperationCancelled(Exception):
+    """Le traitement a été annulé (client parti, job abandonné) ou a dépassé son échéance"""
+
+# Échéance du traitement en cours dans le contexte d'exécution (requête Flask, job, thread)
+_current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+class Deadline:
+    """Échéance et signal d'annulation d'un traitement.
+
+    Les appels Jira et LLM faits sous cette échéance reçoivent le temps restant comme timeout et
+    s'interrompent dès qu'elle est annulée. is_cancelled permet de brancher une condition externe
+    (job plus suivi par aucun client), évaluée au plus une fois par seconde. Une échéance enfant
+    hérite de l'échéance et de l'annulation de son parent.
+    """
+
+    def __init__(self, seconds=None, is_cancelled=None, parent=None, reason="annulé"):
+        self.expires_at = time.time() + seconds if seconds else None
+        self.parent = parent
+        self.reason = reason
+        self._is_cancelled = is_cancelled
+        self._checked_at = 0
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason=None):
+        if reason:
+            self.reason = reason
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        if self._cancelled.is_set():
+            return True
+        if self._is_cancelled is not None and time.time() - self._checked_at >= 1:
+            self._checked_at = time.time()
+            if self._is_cancelled():
+                self._cancelled.set()
+                return True
+        return self.parent is not None and self.parent.cancelled
+
+    def remaining(self, default=None):
+        """Temps restant en secondes, borné par default ; None si aucune échéance"""
+        limits = [default] if default is not None else []
+        deadline = self
+        while deadline is not None:
+            if deadline.expires_at is not None:
+                limits.append(deadline.expires_at - time.time())
+            deadline = deadline.parent
+        return min(limits) if limits else None
+
+    def wait(self, seconds):
+        """Attend jusqu'à seconds secondes, en se réveillant dès une annulation explicite"""
+        self._cancelled.wait(seconds)
+
+    def check(self):
+        """Lève OperationCancelled si le traitement est annulé ou hors délai"""
+        if self.cancelled:
+            raise OperationCancelled(f"Traitement {self.reason}")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise OperationCancelled("Délai du traitement dépassé")
+
+@contextmanager
+def deadline_scope(seconds=None, is_cancelled=None, parent=None, reason="annulé"):
+    """Exécute le bloc sous une échéance, enfant de l'échéance courante (ou de parent)"""
+    deadline = Deadline(seconds, is_cancelled, parent=parent or _current_deadline.get(), reason=reason)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+def check_deadline():
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+def bounded_timeout(timeout):
+    """Timeout (connexion, lecture) réduit au temps restant de l'échéance courante"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return timeout
+    deadline.check()
+    remaining = deadline.remaining()
+    if remaining is None:
+        return timeout
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return (min(connect, remaining), min(read, remaining))
+
+class JiraClient:
+    """Client partagé pour l'API REST Jira.
+
+    Réutilise une session HTTP keep-alive (un pool de connexions par processus worker)
+    afin d'éviter une nouvelle négociation TCP+TLS à chaque appel, et applique
+    des timeouts par défaut à toutes les requêtes.
+    """
+
+    def __init__(self, base_url, email, api_token, pool_size=10, timeout=(5, 30)):
+        self.base_url = base_url
+        self.auth = (email, api_token)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Session HTTP du processus courant (recréée après un fork de worker)"""
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    session.auth = self.auth
+                    session.headers.update({"Accept": "application/json"})
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def url(self, path):
+        """Construit l'URL complète d'une ressource de l'API REST v2"""
+        return f"https://{self.base_url}/rest/api/2/{path.lstrip('/')}"
+
+    def request(self, method, path, operation=None, **kwargs):
+        """Exécute une requête sur l'API Jira avec le timeout par défaut.
+
+        operation nomme l'appel dans les métriques (par défaut la méthode HTTP).
+        """
+        kwargs["timeout"] = bounded_timeout(kwargs.get("timeout", self.timeout))
+        operation = operation or method.lower()
+        status = "exception"
+        with tracer.span(f"jira.{operation}", method=method, path=path) as span, \
+                metrics.track("jira_request_duration_seconds", "jira_requests_in_flight", operation=operation):
+            kwargs["headers"] = dict(kwargs.get("headers") or {}, **{"X-Request-ID": span["trace_id"]})
+            try:
+                response = self.session.request(method, self.url(path), **kwargs)
+                status = response.status_code
+                return response
+            finally:
+                span["attributes"]["status"] = status
+                metrics.inc("jira_requests_total", operation=operation, status=status)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    # Opérations métier utilisées par les routes
+
+    def get_issue(self, issue_key, fields=None):
+        """Récupère une issue (éventuellement limitée à certains champs)"""
+        params = {"fields": ",".join(fields)} if fields else None
+        return self.get(f"issue/{issue_key}", params=params, operation="get_issue")
+
+    def update_issue(self, issue_key, fields):
+        """Met à jour les champs d'une issue"""
+        return self.put(f"issue/{issue_key}", json={"fields": fields}, operation="update_issue")
+
+    def create_issue(self, fields):
+        """Crée une issue"""
+        return self.post("issue", json={"fields": fields}, operation="create_issue")
+
+    def create_issues_bulk(self, issue_updates):
+        """Crée plusieurs issues en un seul appel (au plus 50 par appel)"""
+        return self.post("issue/bulk", json={"issueUpdates": issue_updates}, operation="create_issues_bulk")
+
+    def delete_issue(self, issue_key):
+        """Supprime une issue"""
+        return self.delete(f"issue/{issue_key}", operation="delete_issue")
+
+    def add_comment(self, issue_key, body):
+        """Ajoute un commentaire à une issue"""
+        return self.post(f"issue/{issue_key}/comment", json={"body": body}, operation="add_comment")
+
+    def get_createmeta(self, project_key):
+        """Récupère les métadonnées de création (types d'issues) d'un projet"""
+        return self.get("issue/createmeta", params={"projectKeys": project_key}, operation="createmeta")
+
+    def get_myself(self):
+        """Récupère l'utilisateur associé au token API"""
+        return self.get("myself", operation="myself")
+
+    def get_permissions(self):
+        """Liste les permissions connues de l'instance"""
+        return self.get("permissions", operation="permissions")
+
+    def search(self, jql, fields=None, start_at=0, max_results=50):
+        """Recherche des issues par JQL (une page de résultats)"""
+        params = {"jql": jql, "startAt": start_at, "maxResults": max_results}
+        if fields:
+            params["fields"] = ",".join(fields)
+        return self.get("search", params=params, operation="search")
+
+    def search_pages(self, jql, fields=None, page_size=50):
+        """Parcourt les pages de résultats d'une recherche JQL (générateur)"""
+        start_at = 0
+        while True:
+            response = self.search(jql, fields=fields, start_at=start_at, max_results=page_size)
+            if response.status_code != 200:
+                raise RuntimeError(f"Erreur de recherche JQL: {response.status_code} - {response.text[:200]}")
+            page = response.json()
+            issues = page.get("issues", [])
+            yield page
+            start_at += len(issues)
+            if not issues or start_at >= page.get("total", 0):
+                return
+
+# Client Jira unique partagé par toutes les routes
+jira = JiraClient(JIRA_BASE_URL, JIRA_EMAIL, JIRA_API_TOKEN,
+                  pool_size=JIRA_POOL_SIZE,
+                  timeout=(JIRA_CONNECT_TIMEOUT, JIRA_READ_TIMEOUT))
+
+class LLMUnavailable(Exception):
+    """Levée quand le backend LLM ne peut pas être joint (circuit ouvert ou délai dépassé)"""
+
+class CircuitBreaker:
+    """Disjoncteur : après failure_threshold échecs consécutifs, les appels échouent immédiatement
+    pendant reset_timeout secondes, puis un seul appel de test est autorisé (semi-ouvert).
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Indique si un appel peut être tenté"""
+        with self._lock:
+            if self.state == "open":
+                if time.time() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = "half_open"
+                self._probe_in_flight = False
+                logger.info("Disjoncteur LLM semi-ouvert : appel de test autorisé")
+            if self.state == "half_open":
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("Disjoncteur LLM refermé")
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Disjoncteur LLM ouvert après {self._failures} échec(s) consécutif(s)")
+                self.state = "open"
+                self._opened_at = time.time()
+                self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            retry_in = None
+            if self.state == "open":
+                retry_in = max(0, round(self.reset_timeout - (time.time() - self._opened_at), 1))
+            return {
+                "state": self.state,
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "opened_at": datetime.fromtimestamp(self._opened_at).isoformat() if self._opened_at else None,
+                "retry_in_seconds": retry_in
+            }
+
+class LLMBackend:
+    """Un serveur d'inférence compatible OpenAI, avec sa charge et sa latence observées"""
+
+    def __init__(self, url, model, weight=1):
+        self.url = url
+        self.model = model
+        self.weight = max(float(weight), 0.1)
+        self.breaker = CircuitBreaker(failure_threshold=LLM_BREAKER_THRESHOLD, reset_timeout=LLM_BREAKER_RESET_TIMEOUT)
+        self.in_flight = 0
+        self.avg_latency = None
+        self.healthy = True
+        self.last_checked = None
+
+    @property
+    def health_url(self):
+        # /v1/chat/completions -> /v1/models
+        return self.url.rsplit("/chat/completions", 1)[0] + "/models"
+
+    def score(self):
+        # Plus le score est bas, plus le backend est disponible : charge x latence, pondérée.
+        # Un backend sans mesure de latence est essayé en priorité pour obtenir une première mesure.
+        if self.avg_latency is None:
+            return 0
+        return (self.in_flight + 1) * self.avg_latency / self.weight
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "model": self.model,
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "avg_latency_seconds": round(self.avg_latency, 3) if self.avg_latency is not None else None,
+            "healthy": self.healthy,
+            "last_checked": datetime.fromtimestamp(self.last_checked).isoformat() if self.last_checked else None,
+            "circuit_breaker": self.breaker.stats()
+        }
+
+class LLMRouter:
+    """Répartit les appels entre les backends LLM : le moins chargé (appels en cours et latence
+    observée, pondérés par le poids) parmi les backends sains dont le disjoncteur est fermé.
+    Un sondage périodique de /v1/models met à jour l'état de santé de chaque backend.
+    """
+
+    def __init__(self, backends, health_interval=30):
+        self.backends = backends
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._health_pid = None
+
+    def _ensure_health_checks(self):
+        # Un thread de sondage par processus worker, démarré au premier appel
+        pid = os.getpid()
+        if not self.health_interval or self._health_pid == pid:
+            return
+        with self._lock:
+            if self._health_pid == pid:
+                return
+            self._health_pid = pid
+        threading.Thread(target=self._health_loop, name="llm-health", daemon=True).start()
+
+    def _health_loop(self):
+        while True:
+            for backend in self.backends:
+                self.check_health(backend)
+            time.sleep(self.health_interval)
+
+    def check_health(self, backend):
+        try:
+            response = requests.get(backend.health_url, timeout=5)
+            healthy = response.status_code < 500
+        except Exception:
+            healthy = False
+        if healthy != backend.healthy:
+            logger.warning(f"Backend LLM {backend.url} {'disponible' if healthy else 'indisponible'}")
+            if healthy:
+                # Oublie la pénalité de latence accumulée pendant l'indisponibilité
+                backend.avg_latency = None
+        backend.healthy = healthy
+        backend.last_checked = time.time()
+
+    def choose(self, exclude=()):
+        """Choisit un backend (None si tous sont exclus ou ont leur disjoncteur ouvert)"""
+        self._ensure_health_checks()
+        candidates = [b for b in self.backends if b not in exclude]
+        # Si aucun backend n'est sain d'après le sondage, on tente quand même les autres
+        healthy = [b for b in candidates if b.healthy] or candidates
+        for backend in sorted(healthy, key=lambda b: b.score()):
+            if backend.breaker.allow():
+                with self._lock:
+                    backend.in_flight += 1
+                return backend
+        return None
+
+    def release(self, backend, latency=None):
+        with self._lock:
+            backend.in_flight -= 1
+            if latency is not None:
+                backend.avg_latency = latency if backend.avg_latency is None else 0.8 * backend.avg_latency + 0.2 * latency
+
+    def stats(self):
+        return [backend.stats() for backend in self.backends]
+
+def load_llm_backends():
+    """Lit LLM_BACKENDS (liste JSON de {"url", "model", "weight"}) ; à défaut, API_URL et LLM_MODEL"""
+    raw = os.getenv("LLM_BACKENDS")
+    if not raw:
+        return [LLMBackend(API_URL, LLM_MODEL)]
+    backends = []
+    for entry in json.loads(raw):
+        backends.append(LLMBackend(entry["url"], entry.get("model", LLM_MODEL), entry.get("weight", 1)))
+    logger.info(f"{len(backends)} backend(s) LLM configuré(s)")
+    return backends
+
+llm_router = LLMRouter(load_llm_backends(), health_interval=LLM_HEALTH_INTERVAL)
+
+# Statuts transitoires pour lesquels un nouvel essai a des chances d'aboutir (524 : timeout Cloudflare)
+LLM_RETRYABLE_STATUS = (502, 503, 504, 524)
+
+def _record_llm_attempt(backend, status, started, span, token, error=None):
+    metrics.inc("llm_requests_in_flight", -1, backend=backend.url)
+    metrics.inc("llm_requests_total", backend=backend.url, status=status)
+    metrics.observe("llm_request_duration_seconds", time.time() - started, backend=backend.url)
+    span["attributes"]["status"] = status
+    tracer.finish(span, token, error)
+
+@contextmanager
+def llm_request(payload, stream=False):
+    """Envoie une requête au backend LLM le moins chargé, avec bascule sur un autre backend
+    et retries (backoff exponentiel avec jitter) en cas d'échec, dans un délai global LLM_DEADLINE.
+
+    Les erreurs de connexion et les timeouts déclenchent la bascule. Produit la dernière réponse
+    HTTP obtenue ; lève LLMUnavailable si aucun backend n'est disponible ou si le délai est dépassé,
+    ou l'exception réseau du dernier essai.
+    Le délai est aussi borné par l'échéance courante (OperationCancelled si elle est annulée).
+    """
     headers = {"Content-Type": "application/json"}
+    if stream:
+        headers["Accept"] = "text/event-stream"
+    scope = _current_deadline.get()
+    deadline = time.time() + (scope.remaining(LLM_DEADLINE) if scope else LLM_DEADLINE)
+    failed = []
+    attempt = 0
+    
+    while True:
+        check_deadline()
+        # Délai vérifié avant de choisir : choose() peut réserver l'appel de test d'un disjoncteur semi-ouvert
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise LLMUnavailable(f"Délai de {LLM_DEADLINE}s dépassé")
+        backend = llm_router.choose(exclude=failed)
+        if backend is None and failed:
+            # Tous les backends ont échoué pour cette requête : on réessaie parmi tous
+            failed = []
+            backend = llm_router.choose()
+        if backend is None:
+            raise LLMUnavailable("Aucun backend LLM disponible (circuits ouverts)")
+        remaining = max(deadline - time.time(), 0.1)
+        # Un backend saturé ne répond plus : tant qu'un autre backend n'a pas été essayé, il ne reçoit
+        # qu'une part du délai restant pour qu'un timeout laisse le temps de basculer
+        untried = len([other for other in llm_router.backends if other is not backend and other not in failed
+                       and other.healthy and other.breaker.state == "closed"])
+        read_timeout = remaining / (untried + 1)
+        attempt += 1
+        
+        response, error = None, None
+        started = time.time()
+        metrics.inc("llm_requests_in_flight", backend=backend.url)
+        span, token = tracer.start("llm.request", backend=backend.url, attempt=attempt, stream=stream)
+        headers["X-Request-ID"] = span["trace_id"]
+        try:
+            response = requests.post(backend.url, headers=headers, json=dict(payload, model=backend.model),
+                                     stream=stream, timeout=(min(LLM_CONNECT_TIMEOUT, remaining), read_timeout))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            backend.breaker.record_failure()
+            error = e
+        except Exception as e:
+            backend.breaker.record_failure()
+            llm_router.release(backend)
+            _record_llm_attempt(backend, "exception", started, span, token, e)
+            raise
+        else:
+            if response.status_code in LLM_RETRYABLE_STATUS:
+                backend.breaker.record_failure()
+                error = RuntimeError(f"Erreur API: {response.status_code}")
+            else:
+                if response.status_code >= 500:
+                    backend.breaker.record_failure()
+                else:
+                    backend.breaker.record_success()
+                # Modèle réellement interrogé (les backends peuvent servir des modèles différents)
+                response.llm_model = backend.model
+                try:
+                    yield response
+                finally:
+                    response.close()
+                    llm_router.release(backend, time.time() - started)
+                    _record_llm_attempt(backend, response.status_code, started, span, token)
+                return
+        
+        _record_llm_attempt(backend, response.status_code if response is not None else "exception",
+                            started, span, token, error)
+        # Un échec compte comme un appel très lent pour le choix des prochains backends
+        llm_router.release(backend, max(time.time() - started, LLM_CONNECT_TIMEOUT))
+        failed.append(backend)
+        delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+        if attempt >= LLM_RETRY_ATTEMPTS or time.time() + delay >= deadline:
+            if response is not None:
+                response.llm_model = backend.model
+                try:
+                    yield response
+                finally:
+                    response.close()
+                return
+            raise error
+        logger.warning(f"Appel LLM en échec sur {backend.url} ({error}), "
+                       f"nouvel essai {attempt + 1}/{LLM_RETRY_ATTEMPTS} dans {delay:.1f}s")
+        if response is not None:
+            response.close()
+        if scope:
+            scope.wait(delay)
+        else:
+            time.sleep(delay)
+
+def generate_response(prompt, max_tokens=206, messages=None, meta=None):
+    """Appelle le modèle et retourne le texte généré (ou un message commençant par "Erreur").
+
+    messages remplace le prompt unique (conversation complète) ; si meta est un dict,
+    il reçoit le finish_reason, l'usage et le modèle de la réponse.
+    """
     payload = {
-        "model": "mistral-7b-instruct-v0.3",
-        "messages": [{"role": "user", "content": prompt}],
+        "model": LLM_MODEL,
+        "messages": messages or [{"role": "user", "content": prompt}],
         "max_tokens": max_tokens,
-        "temperature": 0.7
+        "temperature": LLM_TEMPERATURE
     }
     
     try:
-        # Augmente le timeout pour éviter les erreurs 524
-        response = requests.post(API_URL, headers=headers, json=payload, timeout=180)
-        if response.status_code == 200:
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        else:
-            logger.error(f"Erreur API: {response.status_code} - {response.text}")
-            return f"Erreur API: {response.status_code}"
+        with llm_request(payload) as response:
+            if response.status_code == 200:
+                result = response.json()
+                record_llm_usage(result.get("usage"), response.llm_model)
+                if meta is not None:
+                    meta["finish_reason"] = result["choices"][0].get("finish_reason")
+                    meta["usage"] = result.get("usage")
+                    meta["model"] = response.llm_model
+                return result["choices"][0]["message"]["content"]
+            else:
+                logger.error(f"Erreur API: {response.status_code} - {response.text}")
+                return f"Erreur API: {response.status_code}"
+    except OperationCancelled:
+        raise
     except Exception as e:
         logger.error(f"Exception lors de l'appel API: {str(e)}")
         return f"Erreur: {str(e)}"
     
+def stream_response(prompt, max_tokens=206, messages=None, meta=None):
+    """Génère une réponse en streaming (stream: true) et produit les fragments de texte au fil de l'eau"""
+    payload = {
+        "model": LLM_MODEL,
+        "messages": messages or [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens,
+        "temperature": LLM_TEMPERATURE,
+        "stream": True,
+        # Demande le champ usage dans le dernier fragment (ignoré par les serveurs qui ne le gèrent pas)
+        "stream_options": {"include_usage": True}
+    }
+    
+    with llm_request(payload, stream=True) as response:
+        if response.status_code != 200:
+            logger.error(f"Erreur API: {response.status_code} - {response.text}")
+            raise RuntimeError(f"Erreur API: {response.status_code}")
+        response.encoding = "utf-8"
+        if meta is not None:
+            meta["model"] = response.llm_model
+        deadline = _current_deadline.get()
+        for line in response.iter_lines(decode_unicode=True):
+            # Quitter le bloc ferme la connexion : le serveur d'inférence arrête alors le décodage
+            if deadline is not None:
+                deadline.check()
+            # Format SSE OpenAI : lignes "data: {...}" terminées par "data: [DONE]"
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            record_llm_usage(chunk.get("usage"), response.llm_model)
+            if meta is not None and chunk.get("usage"):
+                meta["usage"] = chunk["usage"]
+            choices = chunk.get("choices") or []
+            if choices:
+                if meta is not None and choices[0].get("finish_reason"):
+                    meta["finish_reason"] = choices[0]["finish_reason"]
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    yield content
+
+def generate_response_streaming(prompt, on_delta, max_tokens=206, messages=None, meta=None):
+    """Équivalent de generate_response en streaming : appelle on_delta pour chaque fragment
+    et retourne le texte complet"""
+    chunks = []
+    try:
+        for content in stream_response(prompt, max_tokens=max_tokens, messages=messages, meta=meta):
+            chunks.append(content)
+            on_delta(content)
+    except OperationCancelled:
+        raise
+    except Exception as e:
+        logger.error(f"Exception lors de l'appel API en streaming: {str(e)}")
+        if not chunks:
+            return f"Erreur: {str(e)}"
+        if meta is not None:
+            # Flux interrompu : le texte reçu est incomplet
+            meta["finish_reason"] = "length"
+    return "".join(chunks)
+
 def build_prompt(story_text, format_choice, language_choice="fr"):
+    """Prompt historique (templates version 1) : la user story en tête d'un unique message utilisateur"""
     # Détermine la langue pour le prompt
     lang = "français" if language_choice == "fr" else "anglais"
     
@@ -96,6 +1065,184 @@ def build_prompt(story_text, format_choice, language_choice="fr"):
             f"à effectuer et les résultats attendus pour chaque action, en {lang}."
         )
 
+GHERKIN_INSTRUCTIONS_FR = (
+    "Tu es un assistant de test logiciel. L'utilisateur te fournit une user story ; génère des "
+    "scénarios de test au format Gherkin (Given/When/Then) en français. Chaque scénario doit commencer "
+    "par 'Scenario:' suivi d'un titre descriptif qui résume l'objectif du scénario. Crée plusieurs "
+    "scénarios différents avec des titres uniques qui couvrent différents aspects fonctionnels et cas "
+    "limites. Structure ton résultat comme ceci:\n\n"
+    "Feature: [Titre de la fonctionnalité basé sur la user story]\n\n"
+    "Scenario: [Titre descriptif du premier scénario]\n"
+    "  Given [contexte initial]\n"
+    "  When [action effectuée]\n"
+    "  Then [résultat attendu]\n\n"
+    "Scenario: [Titre descriptif du deuxième scénario]\n"
+    "  Given [contexte initial]\n"
+    "  ...\n\n"
+    "Assure-toi que chaque scénario est clair, concis et testable. Réponds uniquement avec le Gherkin."
+)
+
+GHERKIN_INSTRUCTIONS_EN = (
+    "You are a software testing assistant. The user gives you a user story; write test scenarios in "
+    "Gherkin format (Given/When/Then) in English. Every scenario must start with 'Scenario:' followed by "
+    "a descriptive title summarizing its goal. Write several distinct scenarios with unique titles "
+    "covering different functional aspects and edge cases. Structure your answer like this:\n\n"
+    "Feature: [Feature title based on the user story]\n\n"
+    "Scenario: [Descriptive title of the first scenario]\n"
+    "  Given [initial context]\n"
+    "  When [action performed]\n"
+    "  Then [expected result]\n\n"
+    "Scenario: [Descriptive title of the second scenario]\n"
+    "  Given [initial context]\n"
+    "  ...\n\n"
+    "Make sure every scenario is clear, concise and testable. Answer with the Gherkin only."
+)
+
+ACTIONS_INSTRUCTIONS_FR = (
+    "Tu es un assistant de test logiciel. L'utilisateur te fournit une user story ; génère des cas de "
+    "test détaillant les actions à effectuer et le résultat attendu de chaque action, en français. "
+    "Structure ton résultat comme ceci:\n\n"
+    "Cas de test 1 : [Titre du cas de test]\n"
+    "1. Action : [action à effectuer]\n"
+    "   Résultat attendu : [résultat attendu]\n"
+    "2. Action : ...\n\n"
+    "Cas de test 2 : [Titre du cas de test]\n"
+    "...\n\n"
+    "Couvre les cas nominaux, les cas d'erreur et les cas limites."
+)
+
+ACTIONS_INSTRUCTIONS_EN = (
+    "You are a software testing assistant. The user gives you a user story; write test cases listing the "
+    "actions to perform and the expected result of each action, in English. Structure your answer like this:\n\n"
+    "Test case 1: [Test case title]\n"
+    "1. Action: [action to perform]\n"
+    "   Expected result: [expected result]\n"
+    "2. Action: ...\n\n"
+    "Test case 2: [Test case title]\n"
+    "...\n\n"
+    "Cover nominal cases, error cases and edge cases."
+)
+
+# Demande de suite d'une réponse tronquée, dans la langue du template
+CONTINUATION_INSTRUCTIONS_FR = ("Ta réponse a été coupée. Continue exactement là où elle s'arrête, "
+                                "sans répéter ce qui précède ni ajouter d'introduction.")
+CONTINUATION_INSTRUCTIONS_EN = ("Your answer was cut off. Continue exactly where it stops, "
+                                "without repeating what came before or adding an introduction.")
+
+class PromptTemplate:
+    """Template de prompt versionné pour un format et une langue.
+
+    Les instructions fixes (system) précèdent la user story : tous les appels d'un même template
+    partagent ce préfixe, que les serveurs d'inférence avec cache de préfixe (vLLM, llama.cpp) réutilisent.
+    continuation est la consigne envoyée pour obtenir la suite d'une réponse tronquée.
+    """
+
+    def __init__(self, format_choice, language, version, system=None, user="User story :\n{story}", render=None,
+                 continuation=CONTINUATION_INSTRUCTIONS_FR):
+        self.format = format_choice
+        self.language = language
+        self.version = version
+        self.system = system
+        self.user = user
+        self._render = render
+        self.continuation = continuation
+
+    @property
+    def key(self):
+        return f"{self.format}/{self.language}@{self.version}"
+
+    def messages(self, story_text):
+        if self._render is not None:
+            return [{"role": "user", "content": self._render(story_text)}]
+        user = self.user.format(story=story_text)
+        if not self.system:
+            return [{"role": "user", "content": user}]
+        if LLM_SYSTEM_ROLE:
+            return [{"role": "system", "content": self.system}, {"role": "user", "content": user}]
+        # Modèles sans rôle system : les instructions restent en tête du message, le préfixe reste stable
+        return [{"role": "user", "content": f"{self.system}\n\n{user}"}]
+
+class PromptRegistry:
+    """Templates de prompt par (format, langue) et par version.
+
+    La version la plus récente est utilisée, sauf épinglage via PROMPT_TEMPLATE_PINS
+    (ex. "gherkin/fr=1,detailed/en=1"). Suit aussi, par template, la part des tokens de prompt
+    servis depuis le cache de préfixe du serveur (usage.prompt_tokens_details.cached_tokens).
+    """
+
+    # Anciens noms de format encore acceptés (épinglages existants)
+    FORMAT_ALIASES = {"actions": "detailed"}
+
+    def __init__(self, pins=""):
+        self._templates = {}
+        self._pins = {}
+        for pin in filter(None, (p.strip() for p in pins.split(","))):
+            name, _, version = pin.partition("=")
+            format_choice, _, language = name.strip().partition("/")
+            self._pins[f"{self.FORMAT_ALIASES.get(format_choice, format_choice)}/{language}"] = int(version)
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def register(self, template):
+        self._templates.setdefault((template.format, template.language), {})[template.version] = template
+        return template
+
+    def get(self, format_choice, language_choice="fr"):
+        # Format inconnu : cas de test détaillé, dans la langue demandée si elle existe
+        format_choice = self.FORMAT_ALIASES.get(format_choice, format_choice)
+        versions = (self._templates.get((format_choice, language_choice))
+                    or self._templates.get(("detailed", language_choice))
+                    or self._templates.get((format_choice, "fr"))
+                    or self._templates[("detailed", "fr")])
+        template = next(iter(versions.values()))
+        pinned = self._pins.get(f"{template.format}/{template.language}")
+        return versions.get(pinned) or versions[max(versions)]
+
+    def record(self, template, usage):
+        """Comptabilise l'usage d'un appel fait avec ce template"""
+        if not usage:
+            return
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        with self._lock:
+            stats = self._usage.setdefault(template.key, {"requests": 0, "prompt_tokens": 0,
+                                                          "cached_tokens": 0, "cache_hits": 0})
+            stats["requests"] += 1
+            stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            stats["cached_tokens"] += cached
+            stats["cache_hits"] += 1 if cached else 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                key: dict(stats,
+                          prefix_hit_rate=round(stats["cache_hits"] / stats["requests"], 3),
+                          cached_token_ratio=round(stats["cached_tokens"] / stats["prompt_tokens"], 3)
+                          if stats["prompt_tokens"] else 0.0)
+                for key, stats in self._usage.items()
+            }
+
+prompt_registry = PromptRegistry(PROMPT_TEMPLATE_PINS)
+for _format in ("gherkin", "detailed"):
+    for _language in ("fr", "en"):
+        prompt_registry.register(PromptTemplate(
+            _format, _language, 1,
+            render=lambda story, f=_format, l=_language: build_prompt(story, f, l),
+            continuation=CONTINUATION_INSTRUCTIONS_EN if _language == "en" else CONTINUATION_INSTRUCTIONS_FR))
+prompt_registry.register(PromptTemplate("gherkin", "fr", 2, system=GHERKIN_INSTRUCTIONS_FR))
+prompt_registry.register(PromptTemplate("gherkin", "en", 2, system=GHERKIN_INSTRUCTIONS_EN,
+                                        continuation=CONTINUATION_INSTRUCTIONS_EN))
+prompt_registry.register(PromptTemplate("detailed", "fr", 2, system=ACTIONS_INSTRUCTIONS_FR))
+prompt_registry.register(PromptTemplate("detailed", "en", 2, system=ACTIONS_INSTRUCTIONS_EN, user="User story:\n{story}",
+                                        continuation=CONTINUATION_INSTRUCTIONS_EN))
+
+def build_messages(story_text, format_choice, language_choice="fr"):
+    """Messages à envoyer au modèle avec le template actif. Retourne (template, messages)."""
+    template = prompt_registry.get(format_choice, language_choice)
+    return template, template.messages(story_text)
+
+def messages_text(messages):
+    return "\n".join(message["content"] for message in messages)
+
 def extract_issue_key_from_url(url):
     """Extrait la clé d'issue de l'URL de retour Jira"""
     if not url:
@@ -106,8 +1253,515 @@ def extract_issue_key_from_url(url):
         return match.group(1)
     return ""
 
-def update_jira_story(issue_key, updated_description):
-    """Met à jour la description d'une user story dans Jira avec diagnostic - Ajoute le contenu au lieu de remplacer"""
+class TestStep:
+    """Étape d'un scénario : mot-clé Gherkin et texte, ou action et résultat attendu"""
+
+    def __init__(self, keyword, text, expected=None):
+        self.keyword = keyword
+        self.text = text
+        self.expected = expected
+
+    def to_dict(self):
+        return {"keyword": self.keyword, "text": self.text, "expected": self.expected}
+
+class TestScenario:
+    """Scénario (ou cas de test) : un titre, des étapes et d'éventuelles lignes d'exemples"""
+
+    def __init__(self, title, keyword="Scenario"):
+        self.title = title
+        self.keyword = keyword
+        self.steps = []
+        self.examples = []
+
+    def to_gherkin(self, background=()):
+        lines = [f"{self.keyword}: {self.title}"]
+        if background:
+            lines += [f"  {step.keyword} {step.text}" for step in background]
+        lines += [f"  {step.keyword} {step.text}" for step in self.steps]
+        if self.examples:
+            lines.append("")
+            lines.append("  Examples:")
+            lines += [f"    {row}" for row in self.examples]
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"title": self.title, "keyword": self.keyword,
+                "steps": [step.to_dict() for step in self.steps], "examples": self.examples}
+
+class TestFeature:
+    """Résultat structuré d'une génération : une fonctionnalité et ses scénarios"""
+
+    def __init__(self, title="", format_choice="gherkin"):
+        self.title = title
+        self.format = format_choice
+        self.background = []
+        self.scenarios = []
+
+    def to_feature_file(self, tags=()):
+        """Fichier .feature pour Cucumber / Behave : indentation standard et mots-clés anglais
+        (ceux des templates), les étapes en français du modèle étant converties"""
+        def step_line(step):
+            keyword = GHERKIN_STEP_KEYWORDS_EN.get(step.keyword.lower(), step.keyword)
+            # Les tables de données suivent l'étape, indentées d'un niveau
+            return f"    {keyword} {step.text}".replace("\n", "\n      ")
+        
+        lines = [" ".join(f"@{tag}" for tag in tags)] if tags else []
+        lines += [f"Feature: {self.title or 'Cas de test'}", ""]
+        if self.background:
+            lines.append("  Background:")
+            lines += [step_line(step) for step in self.background]
+            lines.append("")
+        for scenario in self.scenarios:
+            lines.append(f"  {scenario.keyword}: {scenario.title}")
+            lines += [step_line(step) for step in scenario.steps]
+            if scenario.examples:
+                lines += ["", "    Examples:"] + [f"      {row}" for row in scenario.examples]
+            lines.append("")
+        return "\n".join(lines).rstrip() + "\n"
+
+    def to_dict(self):
+        return {"title": self.title, "format": self.format,
+                "background": [step.to_dict() for step in self.background],
+                "scenarios": [scenario.to_dict() for scenario in self.scenarios]}
+
+GHERKIN_FEATURE_KEYWORDS = ("Feature", "Fonctionnalité")
+GHERKIN_BACKGROUND_KEYWORDS = ("Background", "Contexte")
+GHERKIN_SCENARIO_KEYWORDS = ("Scenario Outline", "Scenario Template", "Scenario", "Plan du scénario",
+                             "Plan du Scénario", "Scénario", "Example")
+GHERKIN_EXAMPLES_KEYWORDS = ("Examples", "Exemples")
+GHERKIN_STEP_KEYWORDS = ("Given", "When", "Then", "And", "But", "Étant donné que", "Étant donné",
+                         "Etant donné que", "Etant donné", "Soit", "Quand", "Lorsque", "Alors", "Et", "Mais", "*")
+GHERKIN_STEP_KEYWORDS_EN = {"étant donné que": "Given", "étant donné": "Given", "etant donné que": "Given",
+                            "etant donné": "Given", "soit": "Given", "quand": "When", "lorsque": "When",
+                            "alors": "Then", "et": "And", "mais": "But", "given": "Given", "when": "When",
+                            "then": "Then", "and": "And", "but": "But"}
+
+def _clean_generated_line(line):
+    """Retire la mise en forme Markdown qu'ajoute souvent le modèle (titres, gras, puces, numéros)"""
+    line = line.strip()
+    line = re.sub(r'^#{1,6}\s*', '', line)
+    line = re.sub(r'^(?:[-•]\s+|\d+[.)]\s+)(?=\S)', '', line)
+    line = line.replace("**", "").replace("__", "")
+    return line.strip()
+
+def _match_keyword(line, keywords, colon=True):
+    """Retourne (mot-clé, reste de la ligne) si la ligne commence par l'un des mots-clés"""
+    for keyword in keywords:
+        pattern = rf'^{re.escape(keyword)}\s*\d*\s*:\s*(.*)$' if colon else rf'^{re.escape(keyword)}\s+(.+)$'
+        match = re.match(pattern, line, re.IGNORECASE)
+        if match:
+            return keyword, match.group(1).strip()
+    return None, None
+
+def parse_gherkin(text):
+    """Transforme le Gherkin généré en TestFeature. Les lignes non reconnues sont ignorées."""
+    feature = TestFeature(format_choice="gherkin")
+    scenario = None
+    in_background = in_examples = False
+    for raw_line in (text or "").splitlines():
+        line = _clean_generated_line(raw_line)
+        if not line or line.startswith("```") or line.startswith("@"):
+            continue
+        
+        keyword, rest = _match_keyword(line, GHERKIN_FEATURE_KEYWORDS)
+        if keyword:
+            feature.title = rest
+            continue
+        keyword, rest = _match_keyword(line, GHERKIN_BACKGROUND_KEYWORDS)
+        if keyword:
+            in_background, in_examples, scenario = True, False, None
+            continue
+        keyword, rest = _match_keyword(line, GHERKIN_SCENARIO_KEYWORDS)
+        if keyword:
+            scenario = TestScenario(rest or f"Scénario {len(feature.scenarios) + 1}",
+                                    keyword="Scenario Outline" if "Outline" in keyword or "Plan" in keyword
+                                    or "Template" in keyword else "Scenario")
+            feature.scenarios.append(scenario)
+            in_background = in_examples = False
+            continue
+        keyword, rest = _match_keyword(line, GHERKIN_EXAMPLES_KEYWORDS)
+        if keyword:
+            in_examples = scenario is not None
+            continue
+        if line.startswith("|"):
+            if in_examples:
+                scenario.examples.append(line)
+            elif scenario is not None and scenario.steps:
+                # Table de données rattachée à la dernière étape
+                scenario.steps[-1].text += "\n" + line
+            continue
+        
+        keyword, rest = _match_keyword(line, GHERKIN_STEP_KEYWORDS, colon=False)
+        if keyword:
+            step = TestStep(keyword if keyword == "*" else line[:len(keyword)], rest)
+            if in_background:
+                feature.background.append(step)
+            elif scenario is not None:
+                scenario.steps.append(step)
+    
+    # Un scénario sans étape est un titre isolé ou du texte parasite
+    feature.scenarios = [scenario for scenario in feature.scenarios if scenario.steps]
+    return feature
+
+ACTION_CASE_PATTERN = re.compile(r'^(?:cas de test|test case|test|scénario|scenario)\s*(?:n°\s*)?\d*\s*[:\-–]\s*(.+)$',
+                                 re.IGNORECASE)
+ACTION_PATTERN = re.compile(r'^(?:action|étape|step)\s*\d*\s*[:\-–]\s*(.+)$', re.IGNORECASE)
+EXPECTED_PATTERN = re.compile(r'^(?:résultats? attendus?|resultats? attendus?|expected results?)\s*[:\-–]\s*(.+)$',
+                              re.IGNORECASE)
+
+def parse_action_steps(text):
+    """Transforme un cas de test au format Actions/Résultats attendus en TestFeature.
+
+    Reconnaît les titres "Cas de test N : ...", les couples "Action : ..." / "Résultat attendu : ...",
+    les étapes numérotées suivies de leur résultat et les tableaux Markdown |Action|Résultat|.
+    """
+    feature = TestFeature(format_choice="actions")
+    scenario = None
+    
+    def current_scenario():
+        nonlocal scenario
+        if scenario is None:
+            scenario = TestScenario(feature.title or "Cas de test", keyword="Test")
+            feature.scenarios.append(scenario)
+        return scenario
+    
+    for raw_line in (text or "").splitlines():
+        stripped = raw_line.strip()
+        if not stripped or stripped.startswith("```"):
+            continue
+        
+        if stripped.startswith("|"):
+            cells = [cell.strip().replace("**", "") for cell in stripped.strip("|").split("|")]
+            if all(re.match(r'^:?-+:?$', cell) for cell in cells if cell):
+                continue
+            if cells and re.match(r'^(n°|#|étape|step)?$', cells[0], re.IGNORECASE) and len(cells) > 2:
+                cells = cells[1:]
+            elif cells and re.match(r'^\d+$', cells[0]) and len(cells) > 2:
+                cells = cells[1:]
+            if len(cells) >= 2 and not re.match(r'^(action|actions|étape)s?$', cells[0], re.IGNORECASE):
+                current_scenario().steps.append(TestStep("Action", cells[0], cells[1]))
+            continue
+        
+        line = _clean_generated_line(raw_line)
+        match = EXPECTED_PATTERN.match(line)
+        if match:
+            if scenario is not None and scenario.steps and not scenario.steps[-1].expected:
+                scenario.steps[-1].expected = match.group(1).strip()
+            continue
+        match = ACTION_PATTERN.match(line)
+        if match:
+            current_scenario().steps.append(TestStep("Action", match.group(1).strip()))
+            continue
+        match = ACTION_CASE_PATTERN.match(line)
+        if match:
+            scenario = TestScenario(match.group(1).strip(), keyword="Test")
+            feature.scenarios.append(scenario)
+            continue
+        # Étape numérotée sans mot-clé "Action"
+        if re.match(r'^\d+[.)]\s+\S', stripped) and scenario is not None:
+            scenario.steps.append(TestStep("Action", line))
+            continue
+        if not feature.title and scenario is None and not line.endswith(":"):
+            feature.title = line.rstrip(".")
+    
+    # Un titre de cas de test sans étape qui précède les autres est en fait le titre général
+    if not feature.title and feature.scenarios and not feature.scenarios[0].steps:
+        feature.title = feature.scenarios[0].title
+    feature.scenarios = [scenario for scenario in feature.scenarios if scenario.steps]
+    return feature
+
+def parse_test_cases(text, format_choice):
+    """Parse le résultat d'une génération selon son format"""
+    return parse_gherkin(text) if format_choice == "gherkin" else parse_action_steps(text)
+
+def _stitch_continuation(partial, continuation):
+    """Raccorde une suite au texte partiel en retirant la partie que le modèle a répétée"""
+    tail = partial[-200:]
+    for size in range(min(len(tail), len(continuation)), 0, -1):
+        if tail.endswith(continuation[:size]) and size >= 8:
+            return partial + continuation[size:]
+    return partial + continuation
+
+def estimate_tokens(text):
+    """Estimation grossière du nombre de tokens (environ 3 caractères par token en français)"""
+    return len(text or "") // 3 + 1
+
+# Tokens de réponse : socle par format + tokens par token de user story (plus de règles, plus de scénarios)
+TOKEN_BUDGET_RULES = {
+    "gherkin": (320, 2.5),
+    "detailed": (256, 2.0)
+}
+
+def token_budget(story_text, format_choice, prompt):
+    """Nombre de tokens de réponse à réserver pour une génération.
+
+    Croît avec la longueur de la user story, borné par LLM_MAX_TOKENS_MIN/MAX et par ce qui reste
+    de la fenêtre de contexte une fois le prompt compté.
+    """
+    base, per_story_token = TOKEN_BUDGET_RULES.get(format_choice, TOKEN_BUDGET_RULES["detailed"])
+    budget = int(base + per_story_token * estimate_tokens(story_text))
+    budget = max(LLM_MAX_TOKENS_MIN, min(budget, LLM_MAX_TOKENS_MAX))
+    available = LLM_CONTEXT_WINDOW - estimate_tokens(prompt) - 64
+    return max(64, min(budget, available))
+
+def continue_generation(messages, partial, max_tokens, on_delta=None, meta=None,
+                        instruction=CONTINUATION_INSTRUCTIONS_FR):
+    """Demande au modèle uniquement la suite d'une réponse tronquée (consigne instruction, dans la
+    langue du template). Retourne le texte raccordé."""
+    messages = messages + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": instruction}
+    ]
+    if on_delta is not None:
+        continuation = generate_response_streaming(None, on_delta, max_tokens=max_tokens, messages=messages, meta=meta)
+    else:
+        continuation = generate_response(None, max_tokens=max_tokens, messages=messages, meta=meta)
+    if is_generation_error(continuation):
+        logger.warning(f"Suite de la génération impossible: {continuation}")
+        return None
+    metrics.inc("llm_continuations_total")
+    return _stitch_continuation(partial, continuation)
+
+def _gherkin_blocks(text):
+    """Découpe un texte Gherkin en (titre de la feature, étapes de contexte, scénarios, étapes orphelines).
+
+    Chaque scénario est un dict {keyword, title, lines}. Les étapes trouvées hors de tout scénario
+    sont regroupées dans des scénarios sans titre (title None) à leur position d'origine.
+    """
+    feature_title, background, scenarios = None, [], []
+    current, in_background = None, False
+    for raw_line in (text or "").splitlines():
+        line = _clean_generated_line(raw_line)
+        if not line or line.startswith("```"):
+            continue
+        keyword, rest = _match_keyword(line, GHERKIN_FEATURE_KEYWORDS)
+        if keyword:
+            feature_title = rest
+            current, in_background = None, False
+            continue
+        keyword, rest = _match_keyword(line, GHERKIN_BACKGROUND_KEYWORDS)
+        if keyword:
+            current, in_background = None, True
+            continue
+        keyword, rest = _match_keyword(line, GHERKIN_SCENARIO_KEYWORDS)
+        if keyword:
+            outline = "Outline" in keyword or "Plan" in keyword or "Template" in keyword
+            current = {"keyword": "Scenario Outline" if outline else "Scenario", "title": rest, "lines": []}
+            scenarios.append(current)
+            in_background = False
+            continue
+        step_keyword, _ = _match_keyword(line, GHERKIN_STEP_KEYWORDS, colon=False)
+        examples_keyword, _ = _match_keyword(line, GHERKIN_EXAMPLES_KEYWORDS)
+        if in_background and step_keyword:
+            background.append(line)
+        elif current is not None:
+            current["lines"].append(line)
+        elif step_keyword:
+            # Étape hors scénario : le modèle a oublié l'en-tête "Scenario:"
+            current = {"keyword": "Scenario", "title": None, "lines": [line]}
+            scenarios.append(current)
+        elif examples_keyword or line.startswith("|"):
+            continue
+        # Le reste (phrases d'introduction, commentaires du modèle) est ignoré
+    return feature_title, background, scenarios
+
+def _is_step(line):
+    return _match_keyword(line, GHERKIN_STEP_KEYWORDS, colon=False)[0] is not None
+
+def validate_gherkin(text):
+    """Vérifie la structure demandée par les templates Gherkin. Retourne la liste des problèmes détectés."""
+    feature_title, background, scenarios = _gherkin_blocks(text)
+    problems = []
+    if not feature_title:
+        problems.append("feature_manquante")
+    if not scenarios:
+        problems.append("aucun_scenario")
+    if any(s["title"] is None for s in scenarios):
+        problems.append("etapes_hors_scenario")
+    titles = [s["title"].lower() for s in scenarios if s["title"]]
+    if len(titles) != len(set(titles)):
+        problems.append("titres_dupliques")
+    if any(not any(_is_step(line) for line in s["lines"]) for s in scenarios):
+        problems.append("scenario_vide")
+    return problems
+
+def repair_gherkin(text, fallback_title=""):
+    """Corrige localement ce qui peut l'être : en-têtes manquants, titres dupliqués, scénarios vides"""
+    feature_title, background, scenarios = _gherkin_blocks(text)
+    lines = [f"Feature: {feature_title or fallback_title or 'Cas de test'}", ""]
+    if background:
+        lines += ["Background:"] + [f"  {line}" for line in background] + [""]
+    
+    seen = {}
+    number = 0
+    for scenario in scenarios:
+        if not any(_is_step(line) for line in scenario["lines"]):
+            continue
+        number += 1
+        title = scenario["title"] or f"Scénario {number}"
+        count = seen.get(title.lower(), 0) + 1
+        seen[title.lower()] = count
+        if count > 1:
+            title = f"{title} ({count})"
+        lines.append(f"{scenario['keyword']}: {title}")
+        for line in scenario["lines"]:
+            if line.startswith("|"):
+                lines.append(f"    {line}")
+            else:
+                lines.append(f"  {line}")
+        lines.append("")
+    return "\n".join(lines).rstrip() + "\n"
+
+def _drop_incomplete_tail(text):
+    """Retire la dernière ligne d'un texte coupé au milieu d'une ligne"""
+    if not text or text.endswith("\n"):
+        return text
+    return text.rsplit("\n", 1)[0] + "\n" if "\n" in text else text
+
+def finalize_generation(messages, result, format_choice, truncated=False, on_delta=None, story_text="",
+                        template=None):
+    """Valide la sortie du modèle et la répare localement plutôt que de tout régénérer.
+
+    Une réponse tronquée est complétée par une demande de suite uniquement, avec la consigne du
+    template utilisé ; si la suite échoue, la dernière ligne incomplète est retirée.
+    """
+    if is_generation_error(result):
+        return result
+    continuations = 0
+    while truncated:
+        if continuations >= LLM_MAX_CONTINUATIONS:
+            logger.warning(f"Réponse toujours tronquée après {continuations} suite(s)")
+            result = _drop_incomplete_tail(result)
+            break
+        continuations += 1
+        logger.info(f"Réponse tronquée, demande de la suite au modèle ({continuations}/{LLM_MAX_CONTINUATIONS})")
+        meta = {}
+        # La suite a besoin du prompt et du texte déjà produit dans la fenêtre de contexte
+        max_tokens = token_budget(story_text, format_choice, messages_text(messages) + result)
+        continued = continue_generation(messages, result, max_tokens=max_tokens, on_delta=on_delta, meta=meta,
+                                        instruction=template.continuation if template else CONTINUATION_INSTRUCTIONS_FR)
+        if continued is None:
+            result = _drop_incomplete_tail(result)
+            break
+        result = continued
+        truncated = meta.get("finish_reason") == "length"
+    if format_choice != "gherkin":
+        return result
+    
+    problems = validate_gherkin(result)
+    if not problems:
+        return result
+    for problem in problems:
+        metrics.inc("generation_repairs_total", problem=problem)
+    if "aucun_scenario" in problems:
+        logger.warning("Aucun scénario Gherkin reconnu dans la réponse, elle est conservée telle quelle")
+        return result
+    logger.info(f"Réparation locale de la réponse Gherkin: {', '.join(problems)}")
+    return repair_gherkin(result, fallback_title=" ".join(story_text.split()[:12]))
+
+def build_test_issue_fields(scenario, feature, project_key, issue_type):
+    """Champs Jira d'un ticket de test pour un scénario"""
+    if feature.format == "gherkin":
+        body = scenario.to_gherkin(feature.background)
+        if feature.title:
+            body = f"Feature: {feature.title}\n\n{body}"
+        description = "{code:gherkin}\n" + body + "\n{code}"
+    else:
+        rows = ["||#||Action||Résultat attendu||"]
+        for number, step in enumerate(scenario.steps, start=1):
+            # Le caractère | délimite les colonnes dans le wiki markup Jira
+            action = step.text.replace("|", "\\|")
+            expected = (step.expected or "").replace("|", "\\|") or " "
+            rows.append(f"|{number}|{action}|{expected}|")
+        description = "\n".join(rows)
+    return {
+        "project": {"key": project_key},
+        "issuetype": {"name": issue_type},
+        "summary": scenario.title[:255],
+        "description": description
+    }
+
+def create_test_issues(story_key, feature, project_key=None, issue_type=None):
+    """Crée un ticket de test par scénario, liés à la user story, via issue/bulk.
+
+    Retourne (created, errors) : les tickets créés ({key, summary}) et les scénarios en échec.
+    """
+    project_key = project_key or story_key.split("-")[0]
+    issue_type = issue_type or TEST_ISSUE_TYPE
+    issue_updates = []
+    for scenario in feature.scenarios:
+        issue_updates.append({
+            "fields": build_test_issue_fields(scenario, feature, project_key, issue_type),
+            # Le lien vers la story est créé avec l'issue, sans appel issueLink séparé
+            "update": {"issuelinks": [{"add": {"type": {"name": TEST_LINK_TYPE},
+                                               "outwardIssue": {"key": story_key}}}]}
+        })
+    
+    created, errors = [], []
+    for offset in range(0, len(issue_updates), JIRA_BULK_CREATE_SIZE):
+        chunk = issue_updates[offset:offset + JIRA_BULK_CREATE_SIZE]
+        try:
+            response = jira.create_issues_bulk(chunk)
+        except Exception as e:
+            logger.error(f"Erreur lors de la création des tickets de test: {str(e)}")
+            errors += [{"summary": u["fields"]["summary"], "error": str(e)} for u in chunk]
+            continue
+        if response.status_code not in (200, 201):
+            logger.error(f"Erreur issue/bulk: {response.status_code} - {response.text[:200]}")
+        
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        issues = data.get("issues", [])
+        failed = {e.get("failedElementNumber"): e for e in data.get("errors", [])}
+        # Jira renvoie les issues créées dans l'ordre, en sautant les éléments en échec
+        created_iter = iter(issues)
+        for index, update in enumerate(chunk):
+            summary = update["fields"]["summary"]
+            if index in failed:
+                details = failed[index].get("elementErrors", {})
+                errors.append({"summary": summary,
+                               "error": "; ".join(list(details.get("errorMessages", [])) +
+                                                  [f"{k}: {v}" for k, v in details.get("errors", {}).items()])
+                                        or str(failed[index].get("status"))})
+                continue
+            issue = next(created_iter, None)
+            if issue is None:
+                errors.append({"summary": summary, "error": f"Non créé ({response.status_code})"})
+            else:
+                created.append({"key": issue.get("key"), "summary": summary})
+    
+    logger.info(f"{len(created)} ticket(s) de test créé(s) pour {story_key}, {len(errors)} en erreur")
+    return created, errors
+
+class JiraConflict(Exception):
+    """L'issue a été modifiée dans Jira depuis la version vue par l'utilisateur"""
+
+# Séparateur entre la user story et les cas de test écrits dans sa description
+GENERATED_SECTION_SEPARATOR = "\n\n--------------------\n\n"
+
+def strip_generated_section(description):
+    """Partie de la description au-dessus des cas de test ajoutés par l'application"""
+    return re.split(r"\r?\n\s*-{20}\s*\r?\n", description or "", maxsplit=1)[0].rstrip()
+
+# Verrous par issue : deux mises à jour simultanées depuis ce worker ne doivent pas s'écraser.
+# Nombre fixe de verrous répartis par hachage de la clé : la mémoire ne croît pas avec le nombre d'issues.
+_story_update_locks = [threading.Lock() for _ in range(64)]
+
+def _story_update_lock(issue_key):
+    return _story_update_locks[hash(issue_key) % len(_story_update_locks)]
+
+def update_jira_story(issue_key, updated_description, expected_updated=None, format_choice=None,
+                      language_choice=None):
+    """Met à jour la description d'une user story dans Jira avec des cas de test générés
+
+    La suite est enregistrée dans l'historique de l'issue ; selon JIRA_STORY_UPDATE_MODE, la description
+    garde la user story suivie de la dernière suite seulement ("replace"), d'un lien vers cette version
+    de l'historique ("link"), ou de toutes les suites successives ("append").
+    Si expected_updated (champ `updated` de l'issue vu par l'appelant) est fourni et ne correspond
+    plus à celui de Jira, lève JiraConflict au lieu d'écrire par-dessus une modification concurrente.
+    """
     # Validation initiale
     if not issue_key or not issue_key.strip():
         logger.error("Clé d'issue manquante ou invalide")
@@ -124,158 +1778,1381 @@ def update_jira_story(issue_key, updated_description):
         logger.error(error_msg)
         return False, error_msg
     
-    # URL et authentification
-    api_endpoint = f"https://{JIRA_BASE_URL}/rest/api/2/issue/{issue_key}"
-    auth = (JIRA_EMAIL, JIRA_API_TOKEN)
-    
     logger.info(f"Tentative de mise à jour pour l'issue: {issue_key}")
-    logger.info(f"URL: {api_endpoint}")
-    logger.info(f"Authentification: email={JIRA_EMAIL[:3]}***, token={'présent' if JIRA_API_TOKEN else 'absent'}")
     
-    # Étape 1: Récupérer la description actuelle
-    try:
-        check_response = requests.get(api_endpoint, auth=auth)
-        logger.info(f"Vérification d'accès - Status: {check_response.status_code}")
+    with _story_update_lock(issue_key):
+        # Étape 1: Récupérer uniquement la description actuelle et la date de modification
+        try:
+            check_response = jira.get_issue(issue_key, fields=["description", "updated"])
+            logger.info(f"Vérification d'accès - Status: {check_response.status_code}")
+            
+            if check_response.status_code != 200:
+                error_msg = f"Impossible d'accéder au ticket {issue_key}: {check_response.status_code} - {check_response.text}"
+                logger.error(error_msg)
+                return False, error_msg
+            
+            fields = check_response.json().get('fields', {})
+            current_description = fields.get('description') or ""
+            current_updated = fields.get('updated')
+        except Exception as e:
+            error_msg = f"Erreur lors de la récupération de la description actuelle: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+        
+        # Étape 2: Refuser d'écrire si l'issue a changé depuis que l'utilisateur l'a consultée
+        if expected_updated and current_updated and expected_updated != current_updated:
+            logger.warning(f"Modification concurrente de {issue_key}: attendu {expected_updated}, trouvé {current_updated}")
+            raise JiraConflict(f"Le ticket {issue_key} a été modifié dans Jira entre-temps, "
+                               f"rechargez-le avant de le mettre à jour")
+        
+        # Étape 3: Construire la nouvelle description : la user story puis les cas de test.
+        # La version n'est enregistrée dans l'historique qu'une fois la mise à jour acceptée par Jira.
+        version = generation_history.next_version(issue_key, updated_description)
+        if JIRA_STORY_UPDATE_MODE == "append":
+            story = current_description
+        else:
+            # Les suites écrites précédemment restent consultables dans l'historique
+            story = strip_generated_section(current_description)
+        
+        def describe(version):
+            content = updated_description
+            if JIRA_STORY_UPDATE_MODE == "link" and version is not None:
+                content = (f"Cas de test générés (version {version}) : "
+                           f"{APP_BASE_URL}/api/issues/{issue_key}/generations/{version}?format=text")
+            return story + GENERATED_SECTION_SEPARATOR + content if story else content
+        
+        combined_description = describe(version)
         
-        if check_response.status_code != 200:
-            error_msg = f"Impossible d'accéder au ticket {issue_key}: {check_response.status_code} - {check_response.text}"
+        # Étape 4: Mettre à jour avec la description combinée
+        # (les droits d'édition sont vérifiés par Jira lui-même : un refus revient en 403)
+        try:
+            logger.info(f"Taille de la description combinée: {len(combined_description)} caractères")
+            
+            response = jira.update_issue(issue_key, {"description": combined_description})
+            logger.info(f"Statut de la réponse: {response.status_code}")
+            
+            if response.status_code in [200, 204]:
+                issue_cache.invalidate(issue_key)
+                recorded = generation_history.record(issue_key, updated_description, format_choice, language_choice,
+                                                     source="jira", version=version)
+                if JIRA_STORY_UPDATE_MODE == "link" and recorded is not None and recorded != version:
+                    # Numéro pris entre-temps par une génération : le lien est corrigé
+                    logger.warning(f"Version {version} de {issue_key} déjà prise, lien corrigé vers {recorded}")
+                    fix_response = jira.update_issue(issue_key, {"description": describe(recorded)})
+                    if fix_response.status_code not in [200, 204]:
+                        error_msg = (f"Suite enregistrée en version {recorded} mais la correction du lien a échoué "
+                                     f"({fix_response.status_code} - {fix_response.text}) : la description de "
+                                     f"{issue_key} pointe encore vers la version {version}")
+                        logger.error(error_msg)
+                        return False, error_msg
+                if JIRA_STORY_UPDATE_MODE == "append":
+                    return True, "Description mise à jour avec succès (ajout en bas de la description existante)"
+                return True, "Description mise à jour avec succès (dernière suite de tests sous la user story)"
+            elif response.status_code == 403:
+                error_msg = f"Le compte Jira configuré n'a pas le droit de modifier {issue_key}"
+                logger.error(error_msg)
+                return False, error_msg
+            else:
+                error_msg = f"Erreur lors de la mise à jour: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                return False, error_msg
+        except Exception as e:
+            error_msg = f"Exception lors de la mise à jour: {str(e)}"
             logger.error(error_msg)
             return False, error_msg
+
+# Cache des types d'issues par projet : {project_key: {"types": [...], "fetched_at": ts}}
+_issue_types_cache = {}
+_issue_types_refreshing = set()
+_issue_types_lock = threading.Lock()
+
+def fetch_issue_types(project_key):
+    """Interroge createmeta pour un projet. Retourne None en cas d'échec."""
+    try:
+        response = jira.get_createmeta(project_key)
+        if response.status_code == 200:
+            data = response.json()
+            if data['projects'] and len(data['projects']) > 0:
+                return [issue_type['name'] for issue_type in data['projects'][0]['issuetypes']]
+            return []
+        logger.error(f"Erreur createmeta pour {project_key}: {response.status_code}")
+        return None
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des types d'issues: {str(e)}")
+        return None
+
+def _store_issue_types(project_key, issue_types):
+    with _issue_types_lock:
+        _issue_types_cache[project_key] = {"types": issue_types, "fetched_at": time.time()}
+
+def _refresh_issue_types(project_key):
+    """Rafraîchit l'entrée du cache en arrière-plan"""
+    try:
+        issue_types = fetch_issue_types(project_key)
+        if issue_types is not None:
+            _store_issue_types(project_key, issue_types)
+            logger.info(f"Types d'issues rafraîchis pour le projet {project_key}")
+    finally:
+        with _issue_types_lock:
+            _issue_types_refreshing.discard(project_key)
+
+def get_issue_types(project_key=None):
+    """Retourne les types d'issues d'un projet depuis le cache (stale-while-revalidate)"""
+    project_key = project_key or JIRA_PROJECT_KEY
+    
+    with _issue_types_lock:
+        entry = _issue_types_cache.get(project_key)
+    age = time.time() - entry["fetched_at"] if entry else None
+    
+    # Absent ou trop ancien : chargement synchrone
+    if entry is None or age > ISSUE_TYPES_CACHE_TTL + ISSUE_TYPES_STALE_TTL:
+        issue_types = fetch_issue_types(project_key)
+        if issue_types is None:
+            return entry["types"] if entry else []
+        _store_issue_types(project_key, issue_types)
+        return issue_types
+    
+    # Périmé : on sert la valeur en cache et on rafraîchit en arrière-plan
+    if age > ISSUE_TYPES_CACHE_TTL:
+        with _issue_types_lock:
+            start_refresh = project_key not in _issue_types_refreshing
+            _issue_types_refreshing.add(project_key)
+        if start_refresh:
+            threading.Thread(target=_refresh_issue_types, args=(project_key,), daemon=True).start()
+    
+    return entry["types"]
+
+def invalidate_issue_types(project_key=None):
+    """Invalide le cache des types d'issues d'un projet (ou de tous les projets)"""
+    with _issue_types_lock:
+        if project_key:
+            return 1 if _issue_types_cache.pop(project_key, None) else 0
+        count = len(_issue_types_cache)
+        _issue_types_cache.clear()
+        return count
+
+class IssueCache:
+    """Cache LRU des champs d'une issue (résumé, description), revalidé sur son champ `updated`.
+
+    À chaque lecture seul le champ `updated` est relu, et l'issue complète n'est rechargée que si
+    elle a changé : la valeur renvoyée sert au contrôle des modifications concurrentes.
+    """
+
+    FIELDS = ["summary", "description", "updated"]
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, issue_key):
+        """Retourne les champs de l'issue, ou None si elle est inaccessible"""
+        with self._lock:
+            entry = self._entries.get(issue_key)
+            if entry:
+                self._entries.move_to_end(issue_key)
+        
+        if entry:
+            try:
+                response = jira.get_issue(issue_key, fields=["updated"])
+                if response.status_code == 200 and \
+                        response.json().get("fields", {}).get("updated") == entry["fields"].get("updated"):
+                    return entry["fields"]
+            except Exception as e:
+                logger.warning(f"Erreur lors de la revalidation de l'issue {issue_key}: {str(e)}")
         
-        # Récupérer les données du ticket et la description actuelle
-        issue_data = check_response.json()
-        current_description = issue_data.get('fields', {}).get('description', '')
-        logger.info(f"Ticket trouvé: {issue_data.get('key')} - {issue_data.get('fields', {}).get('summary', '')}")
+        try:
+            response = jira.get_issue(issue_key, fields=self.FIELDS)
+            if response.status_code != 200:
+                logger.error(f"Impossible de lire l'issue {issue_key}: {response.status_code}")
+                self.invalidate(issue_key)
+                return None
+            fields = response.json().get("fields", {})
+        except Exception as e:
+            logger.error(f"Erreur lors de la lecture de l'issue {issue_key}: {str(e)}")
+            return None
+        
+        with self._lock:
+            self._entries[issue_key] = {"fields": fields}
+            self._entries.move_to_end(issue_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return fields
+
+    def invalidate(self, issue_key):
+        with self._lock:
+            self._entries.pop(issue_key, None)
+
+issue_cache = IssueCache(max_entries=ISSUE_CACHE_SIZE)
+
+def add_comment_button_to_issue(issue_key):
+    """Ajoute un commentaire avec un bouton vers votre application"""
+    
+    button_link = f"{APP_BASE_URL}/jira-panel?issueKey={issue_key}"
+    
+    # Utiliser le formatage Atlassian pour créer un bouton plus visible
+    comment_body = (
+        "h2. QaliLab AI - Générateur de Tests\n\n"
+        "{panel:title=Générateur de cas de test|borderColor=#0052CC|titleBGColor=#0052CC|titleColor=white|bgColor=#FFFFFF}\n"
+        "Utilisez QaliLab AI pour générer automatiquement des cas de test pour cette User Story.\n\n"
+        "{button:Générer des cas de test|" + button_link + "}\n\n"
+        "_(Cliquez sur le bouton ci-dessus pour ouvrir l'outil QaliLab AI)_\n"
+        "{panel}"
+    )
+    
+    try:
+        response = jira.add_comment(issue_key, comment_body)
+        if response.status_code == 201:
+            return True, "Commentaire ajouté avec succès"
+        else:
+            error_msg = f"Erreur: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            return False, error_msg
+    except Exception as e:
+        error_msg = f"Exception: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+def normalize_story(story_text):
+    """Normalise le texte d'une story (Unicode NFC, espaces) pour le calcul des clés de cache"""
+    return " ".join(unicodedata.normalize("NFC", story_text or "").split())
+
+def generation_cache_key(story_text, format_choice, language_choice="fr"):
+    """Clé de contenu d'une génération : toute entrée qui influence la sortie du modèle en fait partie"""
+    material = json.dumps([
+        normalize_story(story_text),
+        format_choice,
+        language_choice,
+        # Modèles des backends configurés : changer de modèle (ou d'ensemble de backends) change la clé
+        sorted({backend.model for backend in llm_router.backends}),
+        LLM_TEMPERATURE,
+        PROMPT_TEMPLATE_VERSION,
+        prompt_registry.get(format_choice, language_choice).key
+    ], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+def is_generation_error(text):
+    """Indique si le texte retourné par generate_response est un message d'erreur"""
+    return not text or text.startswith("Erreur")
+
+@contextmanager
+def sqlite_connection(db_path, *pragmas):
+    """Connexion SQLite pour un bloc `with` : transaction validée (ou annulée en cas d'erreur)
+    puis connexion fermée, pour ne pas laisser de descripteur ni de lecteur WAL ouvert par appel"""
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        for pragma in pragmas:
+            conn.execute(pragma)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+class GenerationCache:
+    """Cache des cas de test générés, adressé par contenu.
+
+    Deux niveaux : un LRU en mémoire par processus et, si db_path est défini,
+    une table SQLite partagée entre workers, purgée des entrées les moins
+    récemment utilisées au-delà de max_bytes.
+    """
+
+    def __init__(self, max_entries=256, db_path=None, max_bytes=50 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        # Dernière génération connue par issue : {issue_key: {"key", "format", "language", "generated_at"}}
+        self._issues = {}
+        self._lock = threading.Lock()
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS generations ("
+                    "key TEXT PRIMARY KEY, result TEXT, size INTEGER, created_at REAL, accessed_at REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_accessed ON generations (accessed_at)")
+                # Bases créées avant l'enregistrement du modèle ayant produit chaque entrée
+                if "model" not in [row[1] for row in conn.execute("PRAGMA table_info(generations)")]:
+                    conn.execute("ALTER TABLE generations ADD COLUMN model TEXT")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS issue_generations ("
+                    "issue_key TEXT PRIMARY KEY, key TEXT, format TEXT, language TEXT, generated_at REAL)"
+                )
+
+    def _connect(self):
+        return sqlite_connection(self.db_path)
+
+    def _remember(self, key, result, model=None):
+        with self._lock:
+            self._entries[key] = (result, model)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key, meta=None):
+        """Retourne le texte en cache pour key, ou None ; si meta est un dict, il reçoit le modèle
+        qui a produit ce texte"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.db_path:
+            try:
+                with self._connect() as conn:
+                    entry = conn.execute("SELECT result, model FROM generations WHERE key = ?", (key,)).fetchone()
+                    if entry:
+                        conn.execute("UPDATE generations SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            except Exception as e:
+                logger.error(f"Erreur lors de la lecture du cache de génération: {str(e)}")
+                return None
+            if entry:
+                self._remember(key, *entry)
+        if not entry:
+            return None
+        if meta is not None:
+            meta["model"] = entry[1]
+        return entry[0]
+
+    def set(self, key, result, model=None):
+        self._remember(key, result, model)
+        if not self.db_path:
+            return
+        size = len(result.encode("utf-8"))
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO generations (key, result, size, created_at, accessed_at, model) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (key, result, size, now, now, model))
+                self._evict(conn)
+        except Exception as e:
+            logger.error(f"Erreur lors de l'écriture du cache de génération: {str(e)}")
+
+    def _evict(self, conn):
+        # Supprime les entrées les moins récemment utilisées jusqu'à repasser sous max_bytes
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in conn.execute("SELECT key, size FROM generations ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.info(f"Cache de génération: {evicted} entrée(s) évincée(s)")
+
+    def remember_issue(self, issue_key, key, format_choice, language_choice):
+        """Associe une issue à sa dernière génération"""
+        entry = {"key": key, "format": format_choice, "language": language_choice, "generated_at": time.time()}
+        with self._lock:
+            self._issues[issue_key] = entry
+        if not self.db_path:
+            return
+        try:
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO issue_generations VALUES (?, ?, ?, ?, ?)",
+                             (issue_key, key, format_choice, language_choice, entry["generated_at"]))
+        except Exception as e:
+            logger.error(f"Erreur lors de l'enregistrement de la génération de {issue_key}: {str(e)}")
+
+    def last_for_issue(self, issue_key):
+        """Retourne la dernière génération d'une issue (avec son texte), ou None"""
+        with self._lock:
+            entry = self._issues.get(issue_key)
+        if entry is None and self.db_path:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT key, format, language, generated_at FROM issue_generations WHERE issue_key = ?",
+                        (issue_key,)
+                    ).fetchone()
+            except Exception as e:
+                logger.error(f"Erreur lors de la lecture de la génération de {issue_key}: {str(e)}")
+                row = None
+            if row:
+                entry = dict(zip(["key", "format", "language", "generated_at"], row))
+        if entry is None:
+            return None
+        meta = {}
+        result = self.get(entry["key"], meta)
+        if result is None:
+            return None
+        return dict(entry, result=result, model=meta.get("model"))
+
+generation_cache = GenerationCache(max_entries=GENERATION_CACHE_SIZE,
+                                   db_path=GENERATION_CACHE_DB or None,
+                                   max_bytes=GENERATION_CACHE_MAX_BYTES)
+
+def lookup_generation(story_text, format_choice, language_choice="fr", meta=None):
+    """Retourne le cas de test déjà généré pour ces paramètres, ou None"""
+    return generation_cache.get(generation_cache_key(story_text, format_choice, language_choice), meta)
+
+def record_issue_generation(issue_key, story_text, format_choice, language_choice="fr", result=None,
+                            info=None, source="generation"):
+    """Mémorise la génération affichée pour une issue (utilisée par le panneau latéral)
+    et, si son texte est fourni, l'ajoute à l'historique de l'issue"""
+    if not issue_key:
+        return
+    generation_cache.remember_issue(issue_key,
+                                    generation_cache_key(story_text, format_choice, language_choice),
+                                    format_choice, language_choice)
+    if result is not None:
+        generation_history.record(issue_key, result, format_choice, language_choice, info=info, source=source)
+
+class GenerationHistory:
+    """Historique des cas de test générés par issue, dans une base SQLite locale (mode WAL).
+
+    Chaque suite différente générée pour une issue devient une version numérotée, avec son format,
+    sa langue, le modèle, le template de prompt et la durée de génération. Jira ne reçoit que la
+    dernière suite : les précédentes se consultent et se comparent ici sans appel à Jira.
+    Au-delà de max_versions par issue, les plus anciennes sont supprimées.
+    """
+
+    COLUMNS = ["issue_key", "version", "format", "language", "model", "template", "source",
+               "duration_ms", "prompt_tokens", "completion_tokens", "size", "created_at"]
+
+    def __init__(self, db_path=None, max_versions=50):
+        self.db_path = db_path
+        self.max_versions = max_versions
+        if self.db_path:
+            with self._connect() as conn:
+                # WAL : les lectures de l'historique ne bloquent pas les écritures des autres workers
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS generation_versions ("
+                    "issue_key TEXT, version INTEGER, format TEXT, language TEXT, model TEXT, template TEXT, "
+                    "source TEXT, duration_ms REAL, prompt_tokens INTEGER, completion_tokens INTEGER, "
+                    "size INTEGER, created_at REAL, result TEXT, result_hash TEXT, "
+                    "PRIMARY KEY (issue_key, version))"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_versions_hash "
+                             "ON generation_versions (issue_key, result_hash)")
+
+    def _connect(self):
+        return sqlite_connection(self.db_path, "PRAGMA synchronous=NORMAL")
+
+    def next_version(self, issue_key, result):
+        """Numéro que recevrait ce texte s'il était enregistré maintenant (celui d'une version
+        identique s'il en existe une), sans rien écrire ; None si l'historique est désactivé"""
+        if not self.db_path or not issue_key or not result:
+            return None
+        digest = hashlib.sha256(result.encode("utf-8")).hexdigest()
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT version FROM generation_versions WHERE issue_key = ? AND result_hash = ?",
+                                   (issue_key, digest)).fetchone()
+                if row:
+                    return row[0]
+                return conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM generation_versions "
+                                    "WHERE issue_key = ?", (issue_key,)).fetchone()[0]
+        except Exception as e:
+            logger.error(f"Erreur lors de la lecture de l'historique de {issue_key}: {str(e)}")
+            return None
+
+    def record(self, issue_key, result, format_choice, language_choice, info=None, source="generation",
+               version=None):
+        """Ajoute une version si ce texte n'existe pas déjà pour l'issue ; retourne son numéro.
+        version (obtenue par next_version) est utilisée si elle est encore libre."""
+        if not self.db_path or not issue_key or not result:
+            return None
+        info = info or {}
+        usage = info.get("usage") or {}
+        digest = hashlib.sha256(result.encode("utf-8")).hexdigest()
+        try:
+            with self._connect() as conn:
+                # Verrou d'écriture dès la lecture : deux workers ne peuvent pas prendre le même numéro
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT version FROM generation_versions WHERE issue_key = ? AND result_hash = ?",
+                                   (issue_key, digest)).fetchone()
+                if row:
+                    return row[0]
+                latest = conn.execute("SELECT COALESCE(MAX(version), 0) FROM generation_versions "
+                                      "WHERE issue_key = ?", (issue_key,)).fetchone()[0]
+                version = version if version and version > latest else latest + 1
+                conn.execute("INSERT INTO generation_versions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (issue_key, version, format_choice, language_choice, info.get("model"),
+                              info.get("template"), "cache" if info.get("cached") else source,
+                              info.get("duration_ms"), usage.get("prompt_tokens"), usage.get("completion_tokens"),
+                              len(result.encode("utf-8")), time.time(), result, digest))
+                if self.max_versions:
+                    conn.execute("DELETE FROM generation_versions WHERE issue_key = ? AND version <= ?",
+                                 (issue_key, version - self.max_versions))
+        except Exception as e:
+            logger.error(f"Erreur lors de l'enregistrement de l'historique de {issue_key}: {str(e)}")
+            return None
+        logger.info(f"Historique de {issue_key}: version {version} enregistrée")
+        return version
+
+    def versions(self, issue_key, limit=50):
+        """Versions d'une issue, de la plus récente à la plus ancienne, sans leur texte"""
+        if not self.db_path:
+            return []
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM generation_versions "
+                                    "WHERE issue_key = ? ORDER BY version DESC LIMIT ?", (issue_key, limit)).fetchall()
+        except Exception as e:
+            logger.error(f"Erreur lors de la lecture de l'historique de {issue_key}: {str(e)}")
+            return []
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def get(self, issue_key, version=None, format_choice=None):
+        """Retourne une version (la dernière si version est None, éventuellement de ce format)
+        avec son texte, ou None"""
+        if not self.db_path:
+            return None
+        query = f"SELECT {', '.join(self.COLUMNS)}, result FROM generation_versions WHERE issue_key = ?"
+        params = [issue_key]
+        if format_choice:
+            query += " AND format = ?"
+            params.append(format_choice)
+        if version is None:
+            query += " ORDER BY version DESC LIMIT 1"
+        else:
+            query += " AND version = ?"
+            params.append(version)
+        try:
+            with self._connect() as conn:
+                row = conn.execute(query, params).fetchone()
+        except Exception as e:
+            logger.error(f"Erreur lors de la lecture de l'historique de {issue_key}: {str(e)}")
+            return None
+        return dict(zip(self.COLUMNS + ["result"], row)) if row else None
+
+    def diff(self, issue_key, from_version=None, to_version=None):
+        """Diff unifié entre deux versions (par défaut l'avant-dernière et la dernière) ;
+        retourne (ancienne, nouvelle, diff) ou None si l'une des versions n'existe pas"""
+        new = self.get(issue_key, to_version)
+        if new is None:
+            return None
+        if from_version is None:
+            # Version précédente encore conservée (les plus anciennes ont pu être purgées)
+            try:
+                with self._connect() as conn:
+                    from_version = conn.execute("SELECT MAX(version) FROM generation_versions "
+                                                "WHERE issue_key = ? AND version < ?",
+                                                (issue_key, new["version"])).fetchone()[0]
+            except Exception as e:
+                logger.error(f"Erreur lors de la lecture de l'historique de {issue_key}: {str(e)}")
+                return None
+            if from_version is None:
+                return None
+        old = self.get(issue_key, from_version)
+        if old is None:
+            return None
+        lines = difflib.unified_diff(old["result"].splitlines(), new["result"].splitlines(),
+                                     fromfile=f"{issue_key} v{old['version']}", tofile=f"{issue_key} v{new['version']}",
+                                     lineterm="")
+        return old, new, "\n".join(lines)
+
+generation_history = GenerationHistory(db_path=GENERATION_HISTORY_DB or None,
+                                       max_versions=GENERATION_HISTORY_MAX_VERSIONS)
+
+class LLMOverloaded(Exception):
+    """Levée quand le backend LLM est saturé ; retry_after indique le délai conseillé (secondes)"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Contrôle d'admission devant le backend LLM.
+
+    Au plus max_concurrent appels s'exécutent en même temps ; au-delà, au plus max_queue
+    appels attendent (jusqu'à queue_timeout secondes). Les autres sont refusés immédiatement
+    plutôt que de ralentir tout le monde jusqu'au timeout.
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=16, queue_timeout=60):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected = 0
+        # Moyennes glissantes (secondes) du temps d'attente et de la durée d'un appel
+        self._avg_wait = 0.0
+        self._avg_service = 0.0
+
+    def _retry_after(self, queued=0):
+        # Délai estimé pour écouler la file actuelle
+        backlog = self._waiting + queued + 1
+        return max(1, int(round(backlog * (self._avg_service or 1) / self.max_concurrent)))
+
+    def _reject(self, message, queued=0):
+        self._rejected += 1
+        logger.warning(f"Appel LLM refusé: {message} (actifs: {self._active}, en attente: {self._waiting + queued})")
+        return LLMOverloaded(message, retry_after=self._retry_after(queued))
+
+    def check_capacity(self, queued=0):
+        """Refus rapide : lève LLMOverloaded si la capacité et la file d'attente sont pleines.
+
+        queued compte les demandes déjà acceptées mais pas encore arrivées devant le LLM.
+        """
+        with self._cond:
+            if self._active + self._waiting + queued >= self.max_concurrent + self.max_queue:
+                raise self._reject("file d'attente pleine", queued)
+
+    @contextmanager
+    def slot(self):
+        """Réserve une place d'appel au LLM, en attendant si nécessaire dans la file bornée.
+
+        Une demande annulée ou hors délai pendant l'attente lève OperationCancelled : ce n'est pas
+        une surcharge, elle ne compte pas parmi les refus.
+        """
+        start = time.time()
+        deadline = _current_deadline.get()
+        check_deadline()
+        with self._cond:
+            if self._active >= self.max_concurrent:
+                if self._waiting >= self.max_queue:
+                    raise self._reject("file d'attente pleine")
+                self._waiting += 1
+                give_up_at = start + self.queue_timeout
+                try:
+                    while self._active >= self.max_concurrent:
+                        if deadline is not None:
+                            deadline.check()
+                        timeout = give_up_at - time.time()
+                        if timeout <= 0:
+                            break
+                        # Réveil au moins chaque seconde pour voir une annulation
+                        self._cond.wait(min(timeout, 1, deadline.remaining(1) if deadline else 1))
+                finally:
+                    self._waiting -= 1
+                if self._active >= self.max_concurrent:
+                    raise self._reject(f"attente supérieure à {self.queue_timeout}s")
+            self._active += 1
+            self._admitted += 1
+            self._avg_wait = 0.8 * self._avg_wait + 0.2 * (time.time() - start)
         
-        # Vérifier si la description existe
-        if current_description:
-            logger.info("Description actuelle trouvée, préparation à l'ajout du nouveau contenu")
-        else:
-            logger.info("Aucune description actuelle trouvée, le nouveau contenu sera la description complète")
-            current_description = ""
-    except Exception as e:
-        error_msg = f"Erreur lors de la récupération de la description actuelle: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-    
-    # Étape 2: Vérifier si l'utilisateur a les permissions d'édition
-    permissions_endpoint = f"https://{JIRA_BASE_URL}/rest/api/2/user/permission/search?permissions=EDIT_ISSUES"
-    try:
-        perms_response = requests.get(permissions_endpoint, auth=auth)
-        logger.info(f"Vérification permissions - Status: {perms_response.status_code}")
+        started = time.time()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._avg_service = 0.8 * self._avg_service + 0.2 * (time.time() - started)
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted_total": self._admitted,
+                "rejected_total": self._rejected,
+                "avg_wait_seconds": round(self._avg_wait, 3),
+                "avg_call_seconds": round(self._avg_service, 3)
+            }
+
+    def is_idle(self, reserve=1):
+        """Vrai si personne n'attend et qu'un appel de plus laisserait encore `reserve` place(s) libre(s)
+        (avec une seule place au total, il suffit qu'elle soit libre)"""
+        with self._cond:
+            reserve = min(reserve, self.max_concurrent - 1)
+            return self._waiting == 0 and self._active + 1 + reserve <= self.max_concurrent
+
+llm_admission = AdmissionController(max_concurrent=LLM_MAX_CONCURRENCY,
+                                    max_queue=LLM_MAX_QUEUE,
+                                    queue_timeout=LLM_QUEUE_TIMEOUT)
+
+class SingleFlight:
+    """Regroupe les appels concurrents portant sur la même clé : un seul s'exécute,
+    les autres attendent et reçoivent son résultat (ou son exception).
+
+    L'annulation de l'appel en cours ne concerne que son propre client : les appelants qui
+    l'attendaient reprennent alors l'appel à leur compte. Chacun attend dans la limite de sa
+    propre échéance.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _wait(self, future):
+        deadline = _current_deadline.get()
+        while True:
+            remaining = deadline.remaining() if deadline is not None else None
+            try:
+                # Réveil régulier pour voir une annulation de l'appelant lui-même
+                return future.result(timeout=1 if remaining is None else max(0, min(1, remaining)))
+            except FutureTimeoutError:
+                check_deadline()
+
+    def do(self, key, fn):
+        """Exécute fn pour key, ou attend l'appel déjà en cours. Retourne (résultat, partagé)."""
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._calls[key] = future
+            if leader:
+                break
+            try:
+                return self._wait(future), True
+            except OperationCancelled:
+                if future.done() and isinstance(future.exception(), OperationCancelled):
+                    # Appel partagé annulé pour son client : on le relance si le nôtre est toujours là
+                    check_deadline()
+                    continue
+                raise
         
-        if perms_response.status_code != 200:
-            error_msg = f"Impossible de vérifier les permissions: {perms_response.status_code}"
-            logger.error(error_msg)
-    except Exception as e:
-        logger.warning(f"Erreur lors de la vérification des permissions: {str(e)}")
-    
-    # Étape 3: Construire la nouvelle description en combinant l'ancienne et la nouvelle
-    combined_description = current_description
-    
-    # Ajouter une séparation entre l'ancienne et la nouvelle description
-    if current_description:
-        # Ajouter deux lignes vides et un séparateur
-        combined_description += "\n\n--------------------\n\n"
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future)
+            future.set_exception(e)
+            raise
+        self._finish(key, future)
+        future.set_result(result)
+        return result, False
+
+    def _finish(self, key, future):
+        # Retiré avant de publier le résultat : un appelant qui doit relancer trouve la place libre
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+generation_flight = SingleFlight()
+
+def run_generation(story_text, format_choice, language_choice="fr", on_delta=None, regenerate=False, info=None):
+    """Construit le prompt et génère le cas de test pour une user story.
+
+    Le résultat est servi depuis le cache de génération s'il existe (sauf si regenerate).
+    Si on_delta est fourni, la réponse est demandée en streaming et chaque fragment lui est transmis.
+    Les appels concurrents de même clé partagent un seul appel au modèle.
+    Si info est un dict, il reçoit le modèle, le template, la durée (duration_ms) et l'usage de
+    la génération (ceux de l'appel partagé pour un appel regroupé, avec shared=True), ou cached=True
+    si le résultat vient du cache.
+    """
+    cache_key = generation_cache_key(story_text, format_choice, language_choice)
+    if not regenerate:
+        meta = {}
+        cached = generation_cache.get(cache_key, meta)
+        if cached is not None:
+            logger.info(f"Cas de test servi depuis le cache ({cache_key[:12]})")
+            if info is not None:
+                info.update(cached=True, model=meta.get("model"))
+            if on_delta is not None:
+                on_delta(cached)
+            return cached
     
-    # Ajouter la nouvelle description
-    combined_description += updated_description
+    def generate():
+        # Les détails accompagnent le résultat : les appelants regroupés reçoivent ceux de l'appel partagé
+        check_deadline()
+        started = time.time()
+        template, messages = build_messages(story_text, format_choice, language_choice)
+        with tracer.span("generation", format=format_choice, language=language_choice,
+                         template=template.key) as span:
+            queued_at = time.time()
+            with llm_admission.slot():
+                span["attributes"]["queue_wait_ms"] = round((time.time() - queued_at) * 1000, 1)
+                meta = {}
+                max_tokens = token_budget(story_text, format_choice, messages_text(messages))
+                span["attributes"]["max_tokens"] = max_tokens
+                if on_delta is not None:
+                    result = generate_response_streaming(None, on_delta, max_tokens=max_tokens,
+                                                         messages=messages, meta=meta)
+                else:
+                    result = generate_response(None, max_tokens=max_tokens, messages=messages, meta=meta)
+                prompt_registry.record(template, meta.get("usage"))
+                result = finalize_generation(messages, result, format_choice,
+                                             truncated=meta.get("finish_reason") == "length",
+                                             on_delta=on_delta, story_text=story_text, template=template)
+        details = dict(model=meta.get("model") or LLM_MODEL, template=template.key, usage=meta.get("usage"),
+                       duration_ms=round((time.time() - started) * 1000, 1))
+        if not is_generation_error(result):
+            generation_cache.set(cache_key, result, details["model"])
+        return result, details
     
-    # Étape 4: Mettre à jour avec la description combinée
-    payload = {
-        "fields": {
-            "description": combined_description
+    (result, details), shared = generation_flight.do(cache_key, generate)
+    if shared:
+        logger.info(f"Génération partagée avec un appel en cours ({cache_key[:12]})")
+        if on_delta is not None:
+            on_delta(result)
+    if info is not None:
+        info.update(details, shared=shared)
+    return result
+
+class JobStore:
+    """Stocke l'état des jobs de génération en mémoire et, si configuré, dans SQLite.
+
+    La base SQLite permet de suivre un job depuis un autre worker que celui qui l'exécute.
+    """
+
+    def __init__(self, db_path=None, ttl=3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # Notifié à chaque changement d'un job (statut ou texte partiel)
+        self._changed = threading.Condition(self._lock)
+        self._remote_touches = {}
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    "id TEXT PRIMARY KEY, status TEXT, params TEXT, result TEXT, error TEXT, "
+                    "created_at REAL, started_at REAL, finished_at REAL)"
+                )
+                # Dernier signe de vie des clients qui suivent un job depuis un autre worker
+                conn.execute("CREATE TABLE IF NOT EXISTS job_watchers (id TEXT PRIMARY KEY, last_seen REAL)")
+
+    def _connect(self):
+        return sqlite_connection(self.db_path)
+
+    def _persist(self, job):
+        if not self.db_path:
+            return
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job["id"], job["status"], json.dumps(job["params"]), job["result"], job["error"],
+                     job["created_at"], job["started_at"], job["finished_at"])
+                )
+        except Exception as e:
+            logger.error(f"Erreur lors de l'enregistrement du job {job['id']}: {str(e)}")
+
+    def _load(self, job_id):
+        if not self.db_path:
+            return None
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT id, status, params, result, error, created_at, started_at, finished_at "
+                    "FROM jobs WHERE id = ?", (job_id,)
+                ).fetchone()
+        except Exception as e:
+            logger.error(f"Erreur lors de la lecture du job {job_id}: {str(e)}")
+            return None
+        if not row:
+            return None
+        keys = ["id", "status", "params", "result", "error", "created_at", "started_at", "finished_at"]
+        job = dict(zip(keys, row))
+        job["params"] = json.loads(job["params"] or "{}")
+        job["partial"] = ""
+        return job
+
+    # Délai laissé à un client dont le flux SSE s'est coupé pour revenir (rechargement, repli sur le polling)
+    DISCONNECT_GRACE = 5
+
+    def touch(self, job_id):
+        """Note qu'un client suit encore ce job (à chaque interrogation ou fragment relayé)"""
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["last_seen"] = now
+                return
+            # Job exécuté par un autre worker : le signal passe par SQLite, au plus toutes les 5 secondes
+            if not self.db_path or now - self._remote_touches.get(job_id, 0) < 5:
+                return
+            self._remote_touches[job_id] = now
+        try:
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO job_watchers VALUES (?, ?)", (job_id, now))
+        except Exception as e:
+            logger.error(f"Erreur lors de l'enregistrement du suivi du job {job_id}: {str(e)}")
+
+    def watch(self, job_id, delta):
+        """Compte les flux SSE ouverts sur un job local (delta = +1 à l'ouverture, -1 à la fermeture)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["watchers"] = job.get("watchers", 0) + delta
+                job["last_seen"] = time.time()
+
+    def is_abandoned(self, job_id, timeout):
+        """Vrai si plus aucun client ne suit le job depuis timeout secondes
+        (ou depuis DISCONNECT_GRACE secondes si son dernier flux SSE s'est fermé)"""
+        if not timeout:
+            return False
+        with self._lock:
+            job = self._jobs.get(job_id) or {}
+            last_seen = job.get("last_seen")
+            if job.get("watchers") == 0:
+                timeout = min(timeout, self.DISCONNECT_GRACE)
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute("SELECT last_seen FROM job_watchers WHERE id = ?", (job_id,)).fetchone()
+                if row:
+                    last_seen = max(last_seen or 0, row[0])
+            except Exception as e:
+                logger.error(f"Erreur lors de la lecture du suivi du job {job_id}: {str(e)}")
+        return last_seen is not None and time.time() - last_seen > timeout
+
+    def create(self, params):
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "pending",
+            "params": params,
+            "result": None,
+            "partial": "",
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "last_seen": time.time()
         }
-    }
-    
+        with self._lock:
+            self._purge()
+            self._jobs[job["id"]] = job
+        self._persist(job)
+        return dict(job)
+
+    def update(self, job_id, **changes):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(changes)
+            snapshot = dict(job)
+            self._changed.notify_all()
+        self._persist(snapshot)
+        return snapshot
+
+    def append_partial(self, job_id, text):
+        """Ajoute du texte reçu en streaming au résultat partiel (mémoire uniquement)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["partial"] += text
+                self._changed.notify_all()
+
+    def get(self, job_id, wait=0):
+        """Retourne un job ; avec wait > 0, attend jusqu'à wait secondes qu'il se termine"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if wait:
+                    self._changed.wait_for(lambda: job["status"] in ("done", "error"), timeout=wait)
+                return dict(job)
+        return self._load(job_id)
+
+    def count_pending(self):
+        """Nombre de jobs acceptés mais pas encore démarrés"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["status"] == "pending")
+
+    def wait_for_progress(self, job_id, offset, timeout=15):
+        """Attend que le texte partiel dépasse offset caractères ou que le job se termine"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._changed.wait_for(
+                    lambda: len(job["partial"]) > offset or job["status"] in ("done", "error"),
+                    timeout=timeout
+                )
+                return dict(job)
+        # Job exécuté par un autre worker : seul l'état persisté est disponible
+        job = self._load(job_id)
+        if job is not None and job["status"] not in ("done", "error"):
+            time.sleep(min(timeout, 1))
+        return job
+
+    def _purge(self):
+        # Appelée avec le verrou : supprime de la mémoire les jobs terminés expirés
+        limit = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] and job["finished_at"] < limit]
+        for job_id in expired:
+            self._jobs.pop(job_id, None)
+
+job_store = JobStore(db_path=JOBS_DB_PATH, ttl=JOB_TTL)
+
+_generation_executor = None
+_generation_executor_pid = None
+_generation_executor_lock = threading.Lock()
+
+def get_generation_executor():
+    """Pool de threads de génération du processus courant (créé à la demande, après un éventuel fork)"""
+    global _generation_executor, _generation_executor_pid
+    pid = os.getpid()
+    if _generation_executor is None or _generation_executor_pid != pid:
+        with _generation_executor_lock:
+            if _generation_executor is None or _generation_executor_pid != pid:
+                _generation_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS,
+                                                          thread_name_prefix="generation")
+                _generation_executor_pid = pid
+    return _generation_executor
+
+# Jobs en cours par clé de génération, pour rattacher les demandes identiques au même job
+_inflight_jobs = {}
+_inflight_jobs_lock = threading.Lock()
+
+def _run_generation_job(job_id, cache_key):
+    job = job_store.update(job_id, status="running", started_at=time.time())
+    params = job["params"]
     try:
-        logger.info(f"Envoi de la requête de mise à jour avec description combinée")
-        logger.info(f"Taille de la description combinée: {len(combined_description)} caractères")
-        
-        response = requests.put(
-            api_endpoint, 
-            json=payload, 
-            auth=auth,
-            headers={"Content-Type": "application/json"}
-        )
+        on_delta = (lambda text: job_store.append_partial(job_id, text)) if LLM_STREAMING else None
+        # Le job s'exécute dans un autre thread : on le rattache explicitement à la trace de la requête d'origine
+        with tracer.span("job.generation", trace_id=params.get("request_id"), job_id=job_id), \
+                deadline_scope(GENERATION_DEADLINE, reason="abandonné par le client",
+                               is_cancelled=lambda: job_store.is_abandoned(job_id, JOB_ABANDON_TIMEOUT)):
+            info = {}
+            result = run_generation(params["story"], params["format"], params["language"],
+                                    on_delta=on_delta, regenerate=params.get("regenerate", False), info=info)
+        job_store.update(job_id, status="done", result=result, finished_at=time.time())
+        if not is_generation_error(result):
+            record_issue_generation(params.get("issue_key"), params["story"], params["format"], params["language"],
+                                    result=result, info=info)
+        logger.info(f"Job de génération {job_id} terminé")
+    except OperationCancelled as e:
+        logger.info(f"Job de génération {job_id} annulé: {str(e)}")
+        metrics.inc("generations_cancelled_total", source="job")
+        job_store.update(job_id, status="error", error=f"Génération annulée: {str(e)}", finished_at=time.time())
+    except Exception as e:
+        logger.error(f"Erreur dans le job de génération {job_id}: {str(e)}")
+        job_store.update(job_id, status="error", error=str(e), finished_at=time.time())
+    finally:
+        with _inflight_jobs_lock:
+            if _inflight_jobs.get(cache_key) == job_id:
+                del _inflight_jobs[cache_key]
+
+def submit_generation_job(story_text, format_choice, language_choice="fr", issue_key="", regenerate=False):
+    """Crée un job de génération et le place dans le pool de workers. Retourne le job.
+
+    Si un job identique (même clé de génération) est déjà en cours, c'est lui qui est retourné.
+    Lève LLMOverloaded si le backend LLM est saturé et que le résultat n'est pas en cache.
+    """
+    cache_key = generation_cache_key(story_text, format_choice, language_choice)
+    with _inflight_jobs_lock:
+        existing_id = _inflight_jobs.get(cache_key)
+        existing = job_store.get(existing_id) if existing_id else None
+        if existing is not None and existing["status"] in ("pending", "running"):
+            job_store.touch(existing_id)
+            logger.info(f"Demande rattachée au job en cours {existing_id} (issue: {issue_key or '-'})")
+            return existing
         
-        logger.info(f"Statut de la réponse: {response.status_code}")
-        logger.info(f"Contenu de la réponse: {response.text[:200]}")
+        if regenerate or generation_cache.get(cache_key) is None:
+            llm_admission.check_capacity(queued=job_store.count_pending())
         
-        if response.status_code in [200, 204]:
-            return True, "Description mise à jour avec succès (ajout en bas de la description existante)"
-        else:
-            error_msg = f"Erreur lors de la mise à jour: {response.status_code} - {response.text}"
-            logger.error(error_msg)
-            return False, error_msg
-    except Exception as e:
-        error_msg = f"Exception lors de la mise à jour: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
+        job = job_store.create({
+            "story": story_text,
+            "format": format_choice,
+            "language": language_choice,
+            "issue_key": issue_key,
+            "regenerate": regenerate,
+            "request_id": tracer.current_trace_id()
+        })
+        _inflight_jobs[cache_key] = job["id"]
+    get_generation_executor().submit(_run_generation_job, job["id"], cache_key)
+    logger.info(f"Job de génération {job['id']} soumis (issue: {issue_key or '-'})")
+    return job
 
-def get_issue_types():
-    api_endpoint = f"https://{JIRA_BASE_URL}/rest/api/2/issue/createmeta?projectKeys={JIRA_PROJECT_KEY}"
-    auth = (JIRA_EMAIL, JIRA_API_TOKEN)
-    
+def serialize_job(job):
+    """Représentation JSON publique d'un job"""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "issue_key": job["params"].get("issue_key", ""),
+        "result": job["result"],
+        "partial": job.get("partial", ""),
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"]
+    }
+
+def issue_story_text(fields):
+    """Texte de la user story d'une issue : sa description (sans les cas de test ajoutés), ou à défaut son résumé"""
+    return (strip_generated_section((fields or {}).get("description")) or (fields or {}).get("summary") or "").strip()
+
+def _bulk_generate_issue(issue, format_choice, language_choice, trace_id=None, cancel=None):
+    fields = issue.get("fields", {})
+    story_text = issue_story_text(fields)
+    item = {"issue_key": issue["key"], "summary": fields.get("summary", "")}
+    if not story_text:
+        return dict(item, success=False, error="User story vide")
     try:
-        response = requests.get(api_endpoint, auth=auth)
-        if response.status_code == 200:
-            data = response.json()
-            if data['projects'] and len(data['projects']) > 0:
-                return [issue_type['name'] for issue_type in data['projects'][0]['issuetypes']]
-        return []
+        with tracer.span("bulk.issue", trace_id=trace_id, issue_key=issue["key"]), \
+                deadline_scope(GENERATION_DEADLINE, parent=cancel):
+            info = {}
+            result = run_generation(story_text, format_choice, language_choice, info=info)
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des types d'issues: {str(e)}")
-        return []
-    
-def add_comment_button_to_issue(issue_key):
-    """Ajoute un commentaire avec un bouton vers votre application"""
+        return dict(item, success=False, error=str(e))
+    if is_generation_error(result):
+        return dict(item, success=False, error=result)
+    record_issue_generation(issue["key"], story_text, format_choice, language_choice,
+                            result=result, info=info, source="bulk")
+    return dict(item, success=True, result=result)
+
+def bulk_generate(jql, format_choice="gherkin", language_choice="fr", concurrency=2, skip_keys=()):
+    """Génère les cas de test de toutes les issues d'une requête JQL.
+
+    Les issues sont lues page par page et au plus `concurrency` générations tournent
+    en parallèle. Produit des événements "result", "progress" puis "done".
+    Les clés de skip_keys (issues déjà traitées) sont ignorées, ce qui permet de reprendre un traitement interrompu.
+    """
+    concurrency = max(1, min(concurrency, BULK_MAX_CONCURRENCY))
+    skip_keys = set(skip_keys)
+    progress = {"total": None, "done": 0, "failed": 0, "skipped": 0}
     
-    api_endpoint = f"https://{JIRA_BASE_URL}/rest/api/2/issue/{issue_key}/comment"
-    auth = (JIRA_EMAIL, JIRA_API_TOKEN)
+    def pending_issues():
+        for page in jira.search_pages(jql, fields=["summary", "description"], page_size=BULK_PAGE_SIZE):
+            progress["total"] = page.get("total", progress["total"])
+            for issue in page.get("issues", []):
+                if issue["key"] in skip_keys:
+                    progress["skipped"] += 1
+                    continue
+                yield issue
     
-    button_link = f"{APP_BASE_URL}/jira-panel?issueKey={issue_key}"
+    logger.info(f"Génération en masse démarrée (JQL: {jql}, concurrence: {concurrency})")
+    issues = pending_issues()
+    # Annulé si le consommateur abandonne le générateur (client HTTP déconnecté, Ctrl+C) :
+    # les générations en cours s'arrêtent au prochain point de contrôle au lieu d'aller à leur terme
+    cancel = Deadline(reason="interrompu")
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk") as executor:
+        try:
+            running = set()
+            exhausted = False
+            while running or not exhausted:
+                # Ne lit la page suivante que lorsqu'un emplacement se libère
+                while not exhausted and len(running) < concurrency:
+                    issue = next(issues, None)
+                    if issue is None:
+                        exhausted = True
+                    else:
+                        running.add(executor.submit(_bulk_generate_issue, issue, format_choice, language_choice,
+                                                       tracer.current_trace_id(), cancel))
+                if not running:
+                    break
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item = future.result()
+                    progress["done"] += 1
+                    if not item["success"]:
+                        progress["failed"] += 1
+                    yield dict(item, type="result")
+                    yield dict(progress, type="progress")
+        finally:
+            # Avant la sortie du bloc, qui attend la fin des générations en cours
+            cancel.cancel()
     
-    # Utiliser le formatage Atlassian pour créer un bouton plus visible
-    comment = {
-        "body": (
-            "h2. QaliLab AI - Générateur de Tests\n\n"
-            "{panel:title=Générateur de cas de test|borderColor=#0052CC|titleBGColor=#0052CC|titleColor=white|bgColor=#FFFFFF}\n"
-            "Utilisez QaliLab AI pour générer automatiquement des cas de test pour cette User Story.\n\n"
-            "{button:Générer des cas de test|" + button_link + "}\n\n"
-            "_(Cliquez sur le bouton ci-dessus pour ouvrir l'outil QaliLab AI)_\n"
-            "{panel}"
-        )
-    }
+    logger.info(f"Génération en masse terminée: {progress}")
+    yield dict(progress, type="done")
+
+class _ZipStream:
+    """Sortie non positionnable pour zipfile : les octets écrits sont récupérés au fil de l'eau"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def latest_gherkin(issue_key):
+    """Dernière génération Gherkin connue d'une issue (historique, puis cache), sans appel au modèle ni à Jira"""
+    entry = generation_history.get(issue_key, format_choice="gherkin")
+    if entry is None:
+        entry = generation_cache.last_for_issue(issue_key)
+        if entry is not None and entry["format"] != "gherkin":
+            entry = None
+    return entry["result"] if entry else None
+
+def feature_filename(issue_key, title):
+    """Nom de fichier .feature : clé de l'issue suivie du titre en minuscules, sans accents"""
+    slug = unicodedata.normalize("NFKD", title or "").encode("ascii", "ignore").decode("ascii")
+    slug = re.sub(r"[^a-z0-9]+", "_", slug.lower()).strip("_")[:60]
+    return f"{issue_key}_{slug}.feature" if slug else f"{issue_key}.feature"
+
+def export_feature_zip(issue_keys=(), jql=None):
+    """Archive zip d'un fichier .feature par issue, produite morceau par morceau.
+
+    Les cas de test viennent de l'historique ou du cache de génération : rien n'est généré.
+    Chaque fichier est compressé et rendu dès qu'il est écrit, la mémoire ne dépend donc pas
+    du nombre d'issues. Un fichier export.txt liste en fin d'archive les issues sans cas de test Gherkin.
+    """
+    def issues():
+        for issue_key in issue_keys:
+            yield issue_key, ""
+        if jql:
+            for page in jira.search_pages(jql, fields=["summary"], page_size=BULK_PAGE_SIZE):
+                for issue in page.get("issues", []):
+                    yield issue["key"], issue.get("fields", {}).get("summary", "")
     
+    output = _ZipStream()
+    exported, missing = [], []
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+        try:
+            for issue_key, summary in issues():
+                text = latest_gherkin(issue_key)
+                feature = parse_gherkin(text) if text else None
+                if feature is None or not feature.scenarios:
+                    missing.append(issue_key)
+                    continue
+                feature.title = feature.title or summary
+                filename = feature_filename(issue_key, feature.title)
+                archive.writestr(filename, feature.to_feature_file(tags=[issue_key]))
+                exported.append(filename)
+                yield output.pop()
+        except Exception as e:
+            # Les en-têtes sont déjà partis : l'erreur est signalée dans l'archive
+            logger.error(f"Erreur lors de l'export des fichiers .feature: {str(e)}")
+            missing.append(f"(export interrompu : {str(e)})")
+        report = [f"{len(exported)} fichier(s) .feature exporté(s)"] + exported
+        if missing:
+            report += ["", "Sans cas de test Gherkin :"] + missing
+        archive.writestr("export.txt", "\n".join(report) + "\n")
+    logger.info(f"Export .feature terminé: {len(exported)} fichier(s), {len(missing)} issue(s) sans cas de test")
+    yield output.pop()
+
+class PregenerationQueue:
+    """File de pré-génération basse priorité alimentée par les webhooks Jira.
+
+    Les événements d'une même issue sont regroupés pendant `debounce` secondes (seul le dernier
+    compte). Un unique thread par worker traite les issues dues, et seulement quand le contrôle
+    d'admission est au repos : les demandes interactives passent toujours en premier.
+    """
+
+    def __init__(self, debounce=30, max_pending=500, idle_poll=2):
+        self.debounce = debounce
+        self.max_pending = max_pending
+        self.idle_poll = idle_poll
+        self._pending = OrderedDict()  # issue_key -> {"story", "due", "events"}
+        self._cond = threading.Condition()
+        self._worker_pid = None
+        self._stats = {"received": 0, "debounced": 0, "dropped": 0, "generated": 0, "cached": 0, "failed": 0}
+
+    def submit(self, issue_key, story_text):
+        """Planifie la pré-génération d'une issue, en repoussant l'échéance si elle est déjà prévue"""
+        self._ensure_worker()
+        with self._cond:
+            self._stats["received"] += 1
+            entry = self._pending.pop(issue_key, None)
+            if entry is not None:
+                self._stats["debounced"] += 1
+            elif len(self._pending) >= self.max_pending:
+                self._stats["dropped"] += 1
+                logger.warning(f"File de pré-génération pleine, {issue_key} ignorée")
+                return False
+            self._pending[issue_key] = {"story": story_text, "due": time.time() + self.debounce}
+            metrics.set("pregeneration_pending", len(self._pending))
+            self._cond.notify()
+        return True
+
+    def _ensure_worker(self):
+        # Un thread par processus worker, démarré au premier événement
+        pid = os.getpid()
+        if self._worker_pid == pid:
+            return
+        with self._cond:
+            if self._worker_pid == pid:
+                return
+            self._worker_pid = pid
+        threading.Thread(target=self._worker_loop, name="pregeneration", daemon=True).start()
+
+    def _next_due(self):
+        """Attend la prochaine issue due et la retire de la file"""
+        with self._cond:
+            while True:
+                now = time.time()
+                # Les entrées sont réinsérées à chaque événement : la file est triée par échéance
+                for issue_key, entry in self._pending.items():
+                    if entry["due"] <= now:
+                        del self._pending[issue_key]
+                        metrics.set("pregeneration_pending", len(self._pending))
+                        return issue_key, entry["story"]
+                    timeout = entry["due"] - now
+                    break
+                else:
+                    timeout = None
+                self._cond.wait(timeout)
+
+    def _worker_loop(self):
+        while True:
+            issue_key, story_text = self._next_due()
+            # Ne consomme une place LLM que si aucune demande interactive n'attend
+            while not (llm_admission.is_idle() and job_store.count_pending() == 0):
+                time.sleep(self.idle_poll)
+            for format_choice in PREGENERATION_FORMATS:
+                self._generate(issue_key, story_text, format_choice)
+
+    def _generate(self, issue_key, story_text, format_choice):
+        meta = {}
+        cached = lookup_generation(story_text, format_choice, PREGENERATION_LANGUAGE, meta)
+        if cached is not None:
+            record_issue_generation(issue_key, story_text, format_choice, PREGENERATION_LANGUAGE,
+                                    result=cached, info=dict(meta, cached=True))
+            self._count("cached")
+            return
+        info = {}
+        try:
+            with tracer.span("pregeneration", issue_key=issue_key, format=format_choice), \
+                    deadline_scope(GENERATION_DEADLINE):
+                result = run_generation(story_text, format_choice, PREGENERATION_LANGUAGE, info=info)
+        except Exception as e:
+            # LLMOverloaded compris : l'issue sera générée à la demande
+            logger.warning(f"Pré-génération de {issue_key} abandonnée: {str(e)}")
+            self._count("failed")
+            return
+        if is_generation_error(result):
+            self._count("failed")
+            return
+        record_issue_generation(issue_key, story_text, format_choice, PREGENERATION_LANGUAGE,
+                                result=result, info=info, source="pregeneration")
+        self._count("generated")
+        logger.info(f"Cas de test pré-générés pour {issue_key} ({format_choice})")
+
+    def _count(self, outcome):
+        with self._cond:
+            self._stats[outcome] += 1
+        metrics.inc("pregenerations_total", outcome=outcome)
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, pending=len(self._pending), debounce_seconds=self.debounce)
+
+pregeneration_queue = PregenerationQueue(debounce=PREGENERATION_DEBOUNCE, max_pending=PREGENERATION_MAX_PENDING)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Métriques du worker au format texte Prometheus"""
+    admission = llm_admission.stats()
+    metrics.set("llm_admission_active", admission["active"])
+    metrics.set("llm_admission_waiting", admission["waiting"])
+    metrics.set("llm_admission_rejected_total", admission["rejected_total"])
+    metrics.set("generation_jobs_pending", job_store.count_pending())
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/debug/traces")
+def debug_traces():
+    """Dernières traces du worker, filtrables par identifiant de requête et durée minimale"""
     try:
-        response = requests.post(api_endpoint, json=comment, auth=auth)
-        if response.status_code == 201:
-            return True, "Commentaire ajouté avec succès"
-        else:
-            error_msg = f"Erreur: {response.status_code} - {response.text}"
-            logger.error(error_msg)
-            return False, error_msg
-    except Exception as e:
-        error_msg = f"Exception: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
+        min_duration_ms = float(request.args.get("minDurationMs", 0))
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return jsonify({"success": False, "message": "Paramètres minDurationMs ou limit invalides"}), 400
+    traces = tracer.recent(trace_id=request.args.get("traceId"), min_duration_ms=min_duration_ms, limit=limit)
+    if request.args.get("format") == "text":
+        return Response("\n\n".join(format_trace(t) for t in traces) + "\n", mimetype="text/plain")
+    return jsonify({"success": True, "traces": traces})
 
 @app.route("/check-app-status")
 def check_app_status():
     """Endpoint pour vérifier l'état de l'application et sa configuration"""
-    # Vérifie si le fichier descripteur existe
-    descriptor_exists = os.path.exists('atlassian-connect.json')
-    
-    # Si le fichier existe, charge-le pour vérification
-    descriptor_content = None
-    if descriptor_exists:
-        try:
-            with open('atlassian-connect.json', 'r') as f:
-                descriptor_content = json.load(f)
-        except Exception as e:
-            descriptor_content = {"error": str(e)}
-    
     # Vérifie si les variables d'environnement obligatoires sont définies
     env_vars = {
         "JIRA_BASE_URL": bool(JIRA_BASE_URL),
@@ -293,13 +3170,17 @@ def check_app_status():
         "app_running": True,
         "app_version": "1.3",  # Mis à jour
         "server_time": datetime.now().isoformat(),
-        "descriptor_exists": descriptor_exists,
-        "descriptor_content": descriptor_content,
+        "descriptor_content": DESCRIPTOR,
+        "descriptor_etag": DESCRIPTOR_ETAG,
         "env_vars": env_vars,
         "templates_directory_exists": templates_dir,
         "index_template_exists": index_template,
         "app_url": APP_BASE_URL,
-        "descriptor_url": f"{APP_BASE_URL}/atlassian-connect.json"
+        "descriptor_url": f"{APP_BASE_URL}/atlassian-connect.json",
+        "llm_admission": llm_admission.stats(),
+        "llm_backends": llm_router.stats(),
+        "prompt_templates": prompt_registry.stats(),
+        "pregeneration": pregeneration_queue.stats()
     }
     
     return jsonify(status)
@@ -333,33 +3214,243 @@ def handle_update_story():
             logger.error(error_msg)
             return jsonify({"success": False, "message": error_msg}), 400
         
-        success, message = update_jira_story(issue_key, updated_description)
+        success, message = update_jira_story(issue_key, updated_description, data.get("updated"),
+                                             data.get("format"), data.get("language"))
         
         if success:
             return jsonify({"success": True, "message": message})
         else:
             return jsonify({"success": False, "message": message}), 400
+    except JiraConflict as e:
+        return jsonify({"success": False, "message": str(e), "conflict": True}), 409
     except Exception as e:
         error_msg = f"Erreur inattendue: {str(e)}"
         logger.error(error_msg)
         return jsonify({"success": False, "message": error_msg}), 500
 
+@app.route("/api/test-issues", methods=["POST"])
+def api_create_test_issues():
+    """Découpe des cas de test générés en scénarios et crée un ticket Jira par scénario
+
+    Corps JSON : issueKey, testCases (texte généré), format, et optionnellement issueType,
+    projectKey et dryRun (retourne seulement les scénarios reconnus).
+    """
+    data = request.get_json(silent=True) or {}
+    issue_key = (data.get("issueKey") or "").strip().upper()
+    test_cases = data.get("testCases") or ""
+    format_choice = data.get("format", "gherkin")
+    
+    if not re.match(r'^[A-Z]+-\d+$', issue_key) or not test_cases.strip():
+        return jsonify({"success": False, "message": "Paramètres manquants: issueKey et testCases requis"}), 400
+    
+    feature = parse_test_cases(test_cases, format_choice)
+    if not feature.scenarios:
+        return jsonify({"success": False, "message": "Aucun scénario reconnu dans les cas de test"}), 422
+    if data.get("dryRun"):
+        return jsonify({"success": True, "feature": feature.to_dict()})
+    
+    created, errors = create_test_issues(issue_key, feature, data.get("projectKey"), data.get("issueType"))
+    return jsonify({
+        "success": bool(created) and not errors,
+        "message": f"{len(created)} ticket(s) de test créé(s), {len(errors)} en erreur",
+        "created": created,
+        "errors": errors
+    }), 200 if created else 502
+
 @app.route("/get_issue_types", methods=["GET"])
 def handle_get_issue_types():
-    issue_types = get_issue_types()
+    project_key = request.args.get("projectKey", JIRA_PROJECT_KEY)
+    issue_types = get_issue_types(project_key)
     return jsonify({"issue_types": issue_types})
 
+@app.route("/invalidate-issue-types", methods=["POST"])
+def handle_invalidate_issue_types():
+    """Vide le cache des types d'issues (projectKey optionnel, sinon tous les projets)"""
+    project_key = request.args.get("projectKey") or (request.get_json(silent=True) or {}).get("projectKey")
+    invalidated = invalidate_issue_types(project_key)
+    logger.info(f"Cache des types d'issues invalidé ({project_key or 'tous les projets'})")
+    return jsonify({"success": True, "invalidated": invalidated, "project_key": project_key})
+
+@app.route("/api/generate", methods=["POST"])
+def api_generate():
+    """Soumet une génération de cas de test et retourne immédiatement l'identifiant du job"""
+    data = request.get_json(silent=True) or request.form
+    story_text = (data.get("story") or "").strip()
+    if not story_text:
+        return jsonify({"success": False, "message": "Paramètre manquant: story"}), 400
+    
+    try:
+        job = submit_generation_job(story_text,
+                                    data.get("format", "gherkin"),
+                                    data.get("language", "fr"),
+                                    (data.get("issueKey") or "").strip().upper(),
+                                    regenerate=str(data.get("regenerate", "false")).lower() == "true")
+    except LLMOverloaded as e:
+        return jsonify({
+            "success": False,
+            "message": f"Service de génération saturé, réessayez dans {e.retry_after}s",
+            "retry_after": e.retry_after,
+            "llm_admission": llm_admission.stats()
+        }), 429, {"Retry-After": str(e.retry_after)}
+    return jsonify({
+        "success": True,
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": url_for("api_job_status", job_id=job["id"])
+    }), 202
+
+@app.route("/api/bulk-generate", methods=["POST"])
+def api_bulk_generate():
+    """Génère les cas de test des issues d'une requête JQL et renvoie les résultats au fil de l'eau (NDJSON)
+
+    Réservé aux appels authentifiés comme les webhooks (?secret=WEBHOOK_SECRET ou JWT Atlassian Connect).
+    """
+    if not is_authenticated_call(request):
+        return jsonify({"success": False, "message": "Appel non authentifié"}), 401
+    data = request.get_json(silent=True) or {}
+    jql = (data.get("jql") or "").strip()
+    if not jql:
+        return jsonify({"success": False, "message": "Paramètre manquant: jql"}), 400
+    try:
+        concurrency = int(data.get("concurrency", 2))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Paramètre invalide: concurrency"}), 400
+    
+    events = bulk_generate(jql,
+                           data.get("format", "gherkin"),
+                           data.get("language", "fr"),
+                           concurrency=concurrency,
+                           skip_keys=data.get("skipKeys") or ())
+    
+    def lines():
+        try:
+            for event in events:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"Erreur lors de la génération en masse: {str(e)}")
+            yield json.dumps({"type": "error", "message": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            # Client déconnecté : annule immédiatement les générations en cours
+            events.close()
+    
+    return Response(lines(), mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+@app.route("/api/export/features", methods=["GET", "POST"])
+def api_export_features():
+    """Télécharge un zip de fichiers .feature pour une liste d'issues (issueKeys) ou une requête JQL (jql)"""
+    data = request.get_json(silent=True) or {}
+    issue_keys = data.get("issueKeys") or request.args.get("issueKeys", "")
+    if isinstance(issue_keys, str):
+        issue_keys = issue_keys.split(",")
+    issue_keys = [key.strip().upper() for key in issue_keys if key and key.strip()]
+    jql = (data.get("jql") or request.args.get("jql") or "").strip()
+    if not issue_keys and not jql:
+        return jsonify({"success": False, "message": "Paramètre manquant: issueKeys ou jql"}), 400
+    invalid = [key for key in issue_keys if not re.match(r'^[A-Z]+-\d+$', key)]
+    if invalid:
+        return jsonify({"success": False, "message": f"Clés d'issue invalides: {', '.join(invalid)}"}), 400
+    
+    filename = f"cas-de-test-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip"
+    return Response(export_feature_zip(issue_keys, jql or None), mimetype="application/zip",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"',
+                             "X-Accel-Buffering": "no"})
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def api_job_status(job_id):
+    """État d'un job de génération (wait=N pour attendre jusqu'à N secondes la fin du job)"""
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0), 30)
+    except ValueError:
+        wait = 0
+    job_store.touch(job_id)
+    job = job_store.get(job_id, wait=wait)
+    if job is None:
+        return jsonify({"success": False, "message": f"Job introuvable: {job_id}"}), 404
+    job_store.touch(job_id)
+    return jsonify(dict(serialize_job(job), success=True))
+
+@app.route("/api/jobs/<job_id>/stream", methods=["GET"])
+def api_job_stream(job_id):
+    """Relaie le texte d'un job au fil de sa génération (Server-Sent Events)"""
+    def events():
+        offset = 0
+        # Tant que ce flux est ouvert, le job est suivi ; sa fermeture (client parti) peut l'annuler
+        job_store.watch(job_id, +1)
+        try:
+            while True:
+                job = job_store.wait_for_progress(job_id, offset)
+                if job is None:
+                    yield f"event: error\ndata: {json.dumps({'message': f'Job introuvable: {job_id}'})}\n\n"
+                    return
+                job_store.touch(job_id)
+                text = job["partial"]
+                if len(text) > offset:
+                    yield f"data: {json.dumps({'delta': text[offset:]})}\n\n"
+                    offset = len(text)
+                elif job["status"] not in ("done", "error"):
+                    # Commentaire SSE pour garder la connexion ouverte
+                    yield ": keep-alive\n\n"
+                if job["status"] in ("done", "error"):
+                    yield f"event: {job['status']}\ndata: {json.dumps(serialize_job(job))}\n\n"
+                    return
+        finally:
+            job_store.watch(job_id, -1)
+    
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.route("/api/issues/<issue_key>/generations", methods=["GET"])
+def api_generation_history(issue_key):
+    """Versions des cas de test générés pour une issue, de la plus récente à la plus ancienne"""
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+    except ValueError:
+        return jsonify({"success": False, "message": "Paramètre limit invalide"}), 400
+    issue_key = issue_key.strip().upper()
+    return jsonify({"success": True, "issue_key": issue_key,
+                    "versions": generation_history.versions(issue_key, limit=limit)})
+
+@app.route("/api/issues/<issue_key>/generations/<int:version>", methods=["GET"])
+def api_generation_version(issue_key, version):
+    """Une version de l'historique avec son texte (format=text pour le texte seul)"""
+    issue_key = issue_key.strip().upper()
+    entry = generation_history.get(issue_key, version)
+    if entry is None:
+        return jsonify({"success": False, "message": f"Version {version} introuvable pour {issue_key}"}), 404
+    if request.args.get("format") == "text":
+        return Response(entry["result"], mimetype="text/plain")
+    return jsonify(dict(entry, success=True))
+
+@app.route("/api/issues/<issue_key>/generations/diff", methods=["GET"])
+def api_generation_diff(issue_key):
+    """Diff unifié entre deux versions (from / to, par défaut l'avant-dernière et la dernière)"""
+    try:
+        from_version = int(request.args["from"]) if request.args.get("from") else None
+        to_version = int(request.args["to"]) if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"success": False, "message": "Paramètres from ou to invalides"}), 400
+    issue_key = issue_key.strip().upper()
+    compared = generation_history.diff(issue_key, from_version, to_version)
+    if compared is None:
+        return jsonify({"success": False, "message": f"Versions à comparer introuvables pour {issue_key}"}), 404
+    old, new, diff = compared
+    if request.args.get("format") == "text":
+        return Response(diff, mimetype="text/plain")
+    return jsonify({"success": True, "issue_key": issue_key, "from": old["version"], "to": new["version"],
+                    "diff": diff})
+
 @app.route("/test-issue-access/<issue_key>", methods=["GET"])
 def test_issue_access(issue_key):
     """Route pour tester l'accès à un ticket spécifique"""
     # Nettoyer l'issue key
     issue_key = issue_key.strip().upper()
     
-    api_endpoint = f"https://{JIRA_BASE_URL}/rest/api/2/issue/{issue_key}"
-    auth = (JIRA_EMAIL, JIRA_API_TOKEN)
+    api_endpoint = jira.url(f"issue/{issue_key}")
     
     try:
-        response = requests.get(api_endpoint, auth=auth)
+        response = jira.get_issue(issue_key)
         result = {
             "success": response.status_code == 200,
             "status_code": response.status_code,
@@ -397,27 +3488,21 @@ def test_issue_access(issue_key):
 @app.route("/test-update-permissions", methods=["GET"])
 def test_update_permissions():
     """Teste les permissions de mise à jour sur un ticket test"""
-    # Créer d'abord un ticket test
-    create_endpoint = f"https://{JIRA_BASE_URL}/rest/api/2/issue"
-    auth = (JIRA_EMAIL, JIRA_API_TOKEN)
-    
-    # Payload pour créer un ticket test
-    create_payload = {
-        "fields": {
-            "project": {
-                "key": JIRA_PROJECT_KEY
-            },
-            "summary": "Test QaliLab AI - " + datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "description": "Ticket de test créé par QaliLab AI pour vérifier les permissions",
-            "issuetype": {
-                "name": "Task"  # Utilisez le type approprié pour votre projet
-            }
+    # Champs pour créer d'abord un ticket test
+    create_fields = {
+        "project": {
+            "key": JIRA_PROJECT_KEY
+        },
+        "summary": "Test QaliLab AI - " + datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "description": "Ticket de test créé par QaliLab AI pour vérifier les permissions",
+        "issuetype": {
+            "name": "Task"  # Utilisez le type approprié pour votre projet
         }
     }
     
     try:
         # Créer le ticket
-        create_response = requests.post(create_endpoint, json=create_payload, auth=auth)
+        create_response = jira.create_issue(create_fields)
         
         if create_response.status_code != 201:
             return jsonify({
@@ -431,17 +3516,12 @@ def test_update_permissions():
         test_issue_key = test_issue.get("key")
         
         # Tester la mise à jour du ticket créé
-        update_endpoint = f"https://{JIRA_BASE_URL}/rest/api/2/issue/{test_issue_key}"
-        update_payload = {
-            "fields": {
-                "description": "Description mise à jour par QaliLab AI - Test réussi"
-            }
-        }
-        
-        update_response = requests.put(update_endpoint, json=update_payload, auth=auth)
+        update_response = jira.update_issue(test_issue_key, {
+            "description": "Description mise à jour par QaliLab AI - Test réussi"
+        })
         
         # Supprimer le ticket test (optionnel)
-        delete_response = requests.delete(update_endpoint, auth=auth)
+        delete_response = jira.delete_issue(test_issue_key)
         
         return jsonify({
             "success": update_response.status_code in [200, 204],
@@ -460,12 +3540,9 @@ def test_update_permissions():
 @app.route("/verify-api-token", methods=["GET"])
 def verify_api_token():
     """Vérifie la validité du token API Jira"""
-    auth = (JIRA_EMAIL, JIRA_API_TOKEN)
-    
     # Test 1: Vérifier l'accès utilisateur
-    user_endpoint = f"https://{JIRA_BASE_URL}/rest/api/2/myself"
     try:
-        user_response = requests.get(user_endpoint, auth=auth)
+        user_response = jira.get_myself()
         user_result = {
             "status": user_response.status_code,
             "success": user_response.status_code == 200
@@ -480,9 +3557,8 @@ def verify_api_token():
         user_result = {"error": str(e), "success": False}
     
     # Test 2: Vérifier les permissions
-    perms_endpoint = f"https://{JIRA_BASE_URL}/rest/api/2/permissions"
     try:
-        perms_response = requests.get(perms_endpoint, auth=auth)
+        perms_response = jira.get_permissions()
         perms_result = {
             "status": perms_response.status_code,
             "success": perms_response.status_code == 200
@@ -499,13 +3575,10 @@ def verify_api_token():
         "overall_status": user_result["success"] and perms_result["success"]
     })
 
-@app.route("/atlassian-connect.json")
-def descriptor():
-    """Fournit le descripteur atlassian-connect.json conforme aux standards Jira Cloud"""
-    logger.info("Demande du descripteur reçue!")
-    
+def build_descriptor():
+    """Construit le descripteur atlassian-connect.json conforme aux standards Jira Cloud"""
     # Descripteur conforme optimisé pour Jira Cloud
-    descriptor = {
+    return {
         "name": "QaliLab AI",
         "description": "Générateur de cas de test pour les user stories Jira",
         "key": "com.amaniconsulting.qalilab-ai",
@@ -518,6 +3591,9 @@ def descriptor():
             "type": "jwt"
         },
         "apiVersion": 1,
+        "apiMigrations": {
+            "signed-install": True
+        },
         "lifecycle": {
             "installed": "/installed",
             "uninstalled": "/uninstalled"
@@ -575,7 +3651,7 @@ def descriptor():
                         "value": "QaliLab AI"
                     },
                     "location": "atl.jira.view.issue.right.context",
-                    "url": "/jira-panel?issueKey={issue.key}",
+                    "url": "/jira-side-panel?issueKey={issue.key}",
                     "layout": {
                         "width": "100%",
                         "height": "100%"
@@ -587,6 +3663,16 @@ def descriptor():
                     ]
                 }
             ],
+            "webhooks": [
+                {
+                    "event": "jira:issue_created",
+                    "url": "/webhooks/jira"
+                },
+                {
+                    "event": "jira:issue_updated",
+                    "url": "/webhooks/jira"
+                }
+            ],
             "generalPages": [
                 {
                     "key": "qalilab-main-page",
@@ -605,20 +3691,26 @@ def descriptor():
         },
         "enableLicensing": False  # Corrigé : false -> False (majuscule en Python)
     }
-    
-    # Écrire également le descripteur dans un fichier pour référence
-    with open('atlassian-connect.json', 'w') as f:
-        json.dump(descriptor, f, indent=2)
-    
-    logger.info(f"Descripteur servi: {json.dumps(descriptor)[:200]}...")
-    return jsonify(descriptor)
+
+# Le descripteur ne dépend que de la configuration : il est sérialisé une seule fois au démarrage
+DESCRIPTOR = build_descriptor()
+DESCRIPTOR_BYTES = json.dumps(DESCRIPTOR, indent=2).encode("utf-8")
+DESCRIPTOR_ETAG = hashlib.sha256(DESCRIPTOR_BYTES).hexdigest()[:32]
+
+@app.route("/atlassian-connect.json")
+def descriptor():
+    """Fournit le descripteur atlassian-connect.json (304 si Jira possède déjà cette version)"""
+    response = Response(DESCRIPTOR_BYTES, mimetype="application/json")
+    response.set_etag(DESCRIPTOR_ETAG)
+    response.headers["Cache-Control"] = "public, max-age=300"
+    response = response.make_conditional(request)
+    logger.info(f"Descripteur servi (statut {response.status_code})")
+    return response
 
 @app.route("/jira-panel")
 def jira_panel():
     """Affiche le panneau dans Jira"""
     issue_key = request.args.get("issueKey", "")
-    summary = request.args.get("summary", "")
-    description = request.args.get("description", "")
     language = request.args.get("language", "fr")
     
     logger.info(f"Requête jira-panel reçue pour l'issue {issue_key}")
@@ -626,9 +3718,8 @@ def jira_panel():
     # URL pour retourner à l'issue Jira
     jira_return_url = f"https://{JIRA_BASE_URL}/browse/{issue_key}"
     
-    # Construire l'URL avec les paramètres - utiliser issueKey pour rester cohérent
+    # Seule la clé est transmise : la user story est lue côté serveur par la page d'accueil
     redirect_url = url_for('index', 
-                          story=description,
                           issueKey=issue_key,
                           returnUrl=jira_return_url,
                           language=language,
@@ -637,25 +3728,230 @@ def jira_panel():
     logger.info(f"Redirection vers: {redirect_url}")
     return redirect(redirect_url)
 
+@app.route("/jira-side-panel")
+def jira_side_panel():
+    """Panneau latéral léger : affiche la dernière génération de l'issue sans appeler le modèle ni Jira"""
+    issue_key = request.args.get("issueKey", "").strip().upper()
+    language = request.args.get("language", "fr")
+    
+    last_generation = generation_cache.last_for_issue(issue_key) if issue_key else None
+    if last_generation is None and issue_key:
+        # Texte évincé du cache : la dernière version de l'historique
+        last_generation = generation_history.get(issue_key)
+        if last_generation:
+            last_generation["generated_at"] = last_generation["created_at"]
+    generated_at = None
+    if last_generation:
+        generated_at = datetime.fromtimestamp(last_generation["generated_at"]).strftime("%d/%m/%Y %H:%M")
+    logger.info(f"Panneau latéral pour l'issue {issue_key} ({'génération trouvée' if last_generation else 'aucune génération'})")
+    
+    return render_template("panel.html",
+                           issue_key=issue_key,
+                           last_generation=last_generation,
+                           generated_at=generated_at,
+                           generate_url=url_for('jira_panel', issueKey=issue_key, language=language))
+
+class ConnectInstallations:
+    """Installations Atlassian Connect de l'add-on, conservées dans SQLite.
+
+    Le sharedSecret reçu à l'installation signe (HS256) les JWT que Jira joint à ses appels,
+    webhooks compris. Seules les instances Jira de JIRA_BASE_URL sont acceptées, et uniquement par un
+    appel d'installation signé par Atlassian (voir verify_connect_install_jwt).
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS installations ("
+                    "client_key TEXT PRIMARY KEY, base_url TEXT, shared_secret TEXT, installed_at REAL)"
+                )
+
+    def _connect(self):
+        return sqlite_connection(self.db_path)
+
+    def get(self, client_key):
+        if not self.db_path or not client_key:
+            return None
+        with self._connect() as conn:
+            row = conn.execute("SELECT client_key, base_url, shared_secret FROM installations WHERE client_key = ?",
+                               (client_key,)).fetchone()
+        return dict(zip(["client_key", "base_url", "shared_secret"], row)) if row else None
+
+    def for_base_url(self, base_url):
+        if not self.db_path:
+            return None
+        with self._connect() as conn:
+            row = conn.execute("SELECT client_key FROM installations WHERE base_url = ?", (base_url,)).fetchone()
+        return self.get(row[0]) if row else None
+
+    def save(self, client_key, base_url, shared_secret):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM installations WHERE base_url = ?", (base_url,))
+            conn.execute("INSERT OR REPLACE INTO installations VALUES (?, ?, ?, ?)",
+                         (client_key, base_url, shared_secret, time.time()))
+
+    def remove(self, client_key):
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM installations WHERE client_key = ?", (client_key,))
+
+connect_installations = ConnectInstallations(CONNECT_DB_PATH or None)
+
+def connect_query_hash(method, path, args):
+    """Hash de requête (claim qsh) d'un JWT Atlassian Connect : méthode, chemin et paramètres canoniques"""
+    def encode(value):
+        return quote(value, safe="~")
+    path = (path.rstrip("/") or "/").replace("&", "%26")
+    params = "&".join(
+        f"{encode(key)}={','.join(encode(value) for value in sorted(args.getlist(key)))}"
+        for key in sorted(args.keys()) if key != "jwt"
+    )
+    canonical = f"{method.upper()}&{path}&{params}"
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def verify_connect_jwt(req):
+    """Vérifie le JWT Atlassian Connect d'une requête (en-tête Authorization ou paramètre jwt).
+
+    Retourne l'installation émettrice si la signature, l'expiration et le qsh sont valides, sinon None.
+    """
+    header = req.headers.get("Authorization", "")
+    token = header[4:].strip() if header.startswith("JWT ") else req.args.get("jwt")
+    if not token:
+        return None
+    try:
+        issuer = jwt.decode(token, options={"verify_signature": False}).get("iss")
+        installation = connect_installations.get(issuer)
+        if installation is None:
+            logger.warning(f"JWT Connect d'un émetteur inconnu: {issuer}")
+            return None
+        claims = jwt.decode(token, installation["shared_secret"], algorithms=["HS256"],
+                            options={"verify_aud": False})
+    except jwt.InvalidTokenError as e:
+        logger.warning(f"JWT Connect invalide: {str(e)}")
+        return None
+    if not hmac.compare_digest(str(claims.get("qsh", "")).encode("utf-8"),
+                               connect_query_hash(req.method, req.path, req.args).encode("utf-8")):
+        logger.warning("JWT Connect refusé: qsh ne correspond pas à la requête")
+        return None
+    return installation
+
+def verify_connect_install_jwt(req, client_key):
+    """Vérifie le JWT RS256 signé par Atlassian d'un appel /installed ou /uninstalled (signed install).
+
+    La clé publique est lue sur CONNECT_INSTALL_KEYS_URL d'après le kid du JWT ; l'audience doit être
+    APP_BASE_URL et l'émetteur le clientKey annoncé. Retourne les claims si l'appel est authentique, sinon None.
+    """
+    header = req.headers.get("Authorization", "")
+    token = header[4:].strip() if header.startswith("JWT ") else None
+    if not token or not client_key:
+        return None
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+        if not kid:
+            logger.warning("JWT d'installation sans kid")
+            return None
+        response = requests.get(f"{CONNECT_INSTALL_KEYS_URL.rstrip('/')}/{quote(kid, safe='')}",
+                                timeout=(JIRA_CONNECT_TIMEOUT, JIRA_READ_TIMEOUT))
+        response.raise_for_status()
+        claims = jwt.decode(token, response.text, algorithms=["RS256"], audience=APP_BASE_URL.rstrip("/"))
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Clé publique d'installation Atlassian indisponible: {str(e)}")
+        return None
+    except (jwt.InvalidTokenError, ValueError) as e:
+        logger.warning(f"JWT d'installation invalide: {str(e)}")
+        return None
+    if claims.get("iss") != client_key:
+        logger.warning(f"JWT d'installation émis pour un autre clientKey: {claims.get('iss')}")
+        return None
+    if not hmac.compare_digest(str(claims.get("qsh", "")).encode("utf-8"),
+                               connect_query_hash(req.method, req.path, req.args).encode("utf-8")):
+        logger.warning("JWT d'installation refusé: qsh ne correspond pas à la requête")
+        return None
+    return claims
+
+def is_authenticated_call(req):
+    """Vrai si l'appel porte ?secret=WEBHOOK_SECRET ou un JWT Atlassian Connect valide"""
+    if WEBHOOK_SECRET and hmac.compare_digest(req.args.get("secret", "").encode("utf-8"),
+                                              WEBHOOK_SECRET.encode("utf-8")):
+        return True
+    return verify_connect_jwt(req) is not None
+
 @app.route("/installed", methods=["POST"])
 def installed():
-    """Gère l'installation de l'application"""
+    """Gère l'installation de l'application : enregistre le secret partagé de l'instance Jira"""
+    data = request.get_json(silent=True) or {}
+    client_key = data.get("clientKey")
+    base_url = (data.get("baseUrl") or "").rstrip("/")
+    shared_secret = data.get("sharedSecret")
+    # Pas de secret dans les logs
+    logger.info(f"Installation demandée par {base_url} (clientKey {client_key})")
+    if not client_key or not base_url or not shared_secret:
+        return jsonify({"status": "error", "message": "Données d'installation incomplètes"}), 400
+    if urlparse(base_url).hostname != JIRA_BASE_URL.split("://")[-1].strip("/"):
+        logger.warning(f"Installation refusée pour une instance Jira inattendue: {base_url}")
+        return jsonify({"status": "error", "message": "Instance Jira non autorisée"}), 403
+    # Installation et réinstallation sont signées par Atlassian (signed install) : un appel
+    # non signé ne peut pas enregistrer son propre secret pour JIRA_BASE_URL
+    if verify_connect_install_jwt(request, client_key) is None:
+        logger.warning(f"Installation non signée par Atlassian refusée pour {base_url}")
+        return jsonify({"status": "error", "message": "Installation non authentifiée"}), 401
+    if connect_installations.db_path:
+        connect_installations.save(client_key, base_url, shared_secret)
     logger.info("Application installée!")
-    # Loguer les données reçues pour le débogage
-    try:
-        data = request.json
-        logger.info(f"Données d'installation reçues: {json.dumps(data)[:200]}...")
-    except Exception as e:
-        logger.warning(f"Impossible de parser les données d'installation: {str(e)}")
     
     return jsonify({"status": "ok", "message": "Application installée avec succès"})
 
 @app.route("/uninstalled", methods=["POST"])
 def uninstalled():
     """Gère la désinstallation de l'application"""
+    client_key = (request.get_json(silent=True) or {}).get("clientKey")
+    if verify_connect_install_jwt(request, client_key) is not None:
+        connect_installations.remove(client_key)
     logger.info("Application désinstallée!")
     return jsonify({"status": "ok", "message": "Application désinstallée avec succès"})
 
+@app.route("/webhooks/jira", methods=["POST"])
+def jira_webhook():
+    """Reçoit les événements de création / modification d'issues et planifie leur pré-génération
+
+    Authentifié par le JWT Atlassian Connect (webhooks de l'add-on) ou par ?secret=WEBHOOK_SECRET
+    (webhooks d'administration) ; refusé si aucun des deux n'est valide.
+    """
+    if not is_authenticated_call(request):
+        return jsonify({"success": False, "message": "Webhook non authentifié"}), 401
+    
+    data = request.get_json(silent=True) or {}
+    event = data.get("webhookEvent", "")
+    issue = data.get("issue") or {}
+    issue_key = issue.get("key", "")
+    fields = issue.get("fields") or {}
+    
+    if event not in ("jira:issue_created", "jira:issue_updated") or not issue_key:
+        return jsonify({"success": True, "message": "Événement ignoré"})
+    
+    # La description de l'issue a changé : l'entrée du cache du panneau n'est plus à jour
+    issue_cache.invalidate(issue_key)
+    
+    if not PREGENERATION_ENABLED:
+        return jsonify({"success": True, "message": "Pré-génération désactivée"})
+    issue_type = ((fields.get("issuetype") or {}).get("name") or "").lower()
+    if issue_type not in PREGENERATION_ISSUE_TYPES:
+        return jsonify({"success": True, "message": f"Type d'issue ignoré: {issue_type}"})
+    if event == "jira:issue_updated":
+        changed = {item.get("field") for item in (data.get("changelog") or {}).get("items", [])}
+        if changed and not changed & {"description", "summary"}:
+            return jsonify({"success": True, "message": "Ni la description ni le résumé n'ont changé"})
+    
+    story_text = issue_story_text(fields)
+    if not story_text:
+        return jsonify({"success": True, "message": "User story vide"})
+    
+    queued = pregeneration_queue.submit(issue_key, story_text)
+    logger.info(f"Webhook {event} pour {issue_key}: pré-génération {'planifiée' if queued else 'ignorée'}")
+    return jsonify({"success": queued, "message": "Pré-génération planifiée" if queued else "File de pré-génération pleine"})
+
 @app.route("/add-link-to-issue/<issue_key>")
 def add_link(issue_key):
     """Route pour ajouter un commentaire avec un lien à une issue Jira"""
@@ -688,11 +3984,8 @@ def check_env():
 @app.route("/test-jira-auth", methods=["GET"])
 def test_jira_auth():
     """Route pour tester l'authentification Jira"""
-    auth = (JIRA_EMAIL, JIRA_API_TOKEN)
-    test_url = f"https://{JIRA_BASE_URL}/rest/api/2/myself"
-    
     try:
-        response = requests.get(test_url, auth=auth)
+        response = jira.get_myself()
         if response.status_code == 200:
             user_data = response.json()
             return jsonify({
@@ -897,8 +4190,11 @@ def index():
         format_choice = "gherkin"
         language_choice = "fr"  # Français par défaut
         generated_test = None
+        job_id = None
+        response_status, response_headers = 200, {}
         jira_return_url = None
         issue_key = ""
+        issue_updated = None
         
         # Récupérer les paramètres
         if request.method == "GET":
@@ -907,6 +4203,7 @@ def index():
             language_choice = request.args.get("language", "fr")
             jira_return_url = request.args.get("returnUrl", "")
             auto_generate = request.args.get("autoGenerate", "false").lower() == "true"
+            regenerate = request.args.get("regenerate", "false").lower() == "true"
             
             # Récupérer issueKey ou l'extraire de l'URL de retour si nécessaire
             issue_key = request.args.get("issueKey", "")
@@ -917,10 +4214,30 @@ def index():
             
             logger.info(f"Issue key finale: {issue_key}")
             
+            # Sans texte fourni, la user story est lue dans Jira à partir de la clé
+            if not story_text and re.match(r'^[A-Z]+-\d+$', issue_key.strip().upper()):
+                issue_key = issue_key.strip().upper()
+                # La page renvoie `updated` pour le contrôle de conflit : il doit être à jour
+                issue_fields = issue_cache.get(issue_key)
+                if issue_fields:
+                    story_text = issue_story_text(issue_fields)
+                    issue_updated = issue_fields.get("updated")
+            
             if story_text and auto_generate:
                 try:
-                    prompt = build_prompt(story_text, format_choice, language_choice)
-                    generated_test = generate_response(prompt, max_tokens=512)
+                    # Une génération déjà en cache est affichée directement, sans job
+                    cache_meta = {}
+                    if not regenerate:
+                        generated_test = lookup_generation(story_text, format_choice, language_choice, cache_meta)
+                    if generated_test is None:
+                        job_id = submit_generation_job(story_text, format_choice, language_choice,
+                                                       issue_key, regenerate=regenerate)["id"]
+                    else:
+                        record_issue_generation(issue_key, story_text, format_choice, language_choice,
+                                                result=generated_test, info=dict(cache_meta, cached=True))
+                except LLMOverloaded as e:
+                    generated_test = f"Le service de génération est saturé, veuillez réessayer dans {e.retry_after} secondes."
+                    response_status, response_headers = 429, {"Retry-After": str(e.retry_after)}
                 except Exception as e:
                     logger.error(f"Erreur lors de la génération du test: {str(e)}")
                     generated_test = f"Erreur lors de la génération du test: {str(e)}"
@@ -931,6 +4248,8 @@ def index():
             format_choice = request.form.get("format", "gherkin")
             language_choice = request.form.get("language", "fr")
             jira_return_url = request.form.get("returnUrl", "")
+            regenerate = request.form.get("regenerate", "false").lower() == "true"
+            issue_updated = request.form.get("issueUpdated") or None
             
             # Récupérer issueKey ou l'extraire de l'URL de retour
             issue_key = request.form.get("issueKey", "")
@@ -940,8 +4259,18 @@ def index():
             
             if story_text:
                 try:
-                    prompt = build_prompt(story_text, format_choice, language_choice)
-                    generated_test = generate_response(prompt, max_tokens=512)
+                    cache_meta = {}
+                    if not regenerate:
+                        generated_test = lookup_generation(story_text, format_choice, language_choice, cache_meta)
+                    if generated_test is None:
+                        job_id = submit_generation_job(story_text, format_choice, language_choice,
+                                                       issue_key, regenerate=regenerate)["id"]
+                    else:
+                        record_issue_generation(issue_key, story_text, format_choice, language_choice,
+                                                result=generated_test, info=dict(cache_meta, cached=True))
+                except LLMOverloaded as e:
+                    generated_test = f"Le service de génération est saturé, veuillez réessayer dans {e.retry_after} secondes."
+                    response_status, response_headers = 429, {"Retry-After": str(e.retry_after)}
                 except Exception as e:
                     logger.error(f"Erreur lors de la génération du test: {str(e)}")
                     generated_test = f"Erreur lors de la génération du test: {str(e)}"
@@ -960,11 +4289,13 @@ def index():
                                 format_choice=format_choice,
                                 language_choice=language_choice,
                                 generated_test=generated_test,
+                                job_id=job_id,
                                 jira_return_url=jira_return_url,
                                 issue_key=issue_key,
+                                issue_updated=issue_updated,
                                 JIRA_BASE_URL=JIRA_BASE_URL,
                                 APP_BASE_URL=APP_BASE_URL,
-                                issue_types=issue_types)
+                                issue_types=issue_types), response_status, response_headers
         else:
             # Réponse de secours si le template n'existe pas
             return f"""
@@ -1015,22 +4346,56 @@ def index():
         </html>
         """
 
+@app.cli.command("bulk-generate")
+@click.argument("jql")
+@click.option("--format", "format_choice", default="gherkin", type=click.Choice(["gherkin", "detailed"]))
+@click.option("--language", default="fr", type=click.Choice(["fr", "en"]))
+@click.option("--concurrency", default=2, show_default=True, help="Générations simultanées")
+@click.option("--output", default="bulk-results.jsonl", show_default=True,
+              help="Fichier JSONL des résultats ; relancer avec le même fichier reprend là où le traitement s'est arrêté")
+def bulk_generate_command(jql, format_choice, language, concurrency, output):
+    """Génère les cas de test de toutes les issues d'une requête JQL"""
+    # Reprise : les issues déjà générées avec succès dans le fichier de sortie sont ignorées
+    done_keys = set()
+    if os.path.exists(output):
+        with open(output, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get("success"):
+                    done_keys.add(event["issue_key"])
+        click.echo(f"Reprise : {len(done_keys)} issue(s) déjà traitée(s) dans {output}")
+    
+    with open(output, "a", encoding="utf-8") as f:
+        for event in bulk_generate(jql, format_choice, language, concurrency=concurrency, skip_keys=done_keys):
+            if event["type"] == "result":
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+                f.flush()
+                status = "OK" if event["success"] else f"ERREUR ({event['error']})"
+                click.echo(f"{event['issue_key']}: {status}")
+            elif event["type"] == "progress":
+                click.echo(f"  {event['done']} traitée(s) / {event['total']} ({event['failed']} en erreur)")
+            elif event["type"] == "done":
+                click.echo(f"Terminé : {event['done']} traitée(s), {event['failed']} en erreur, "
+                           f"{event['skipped']} ignorée(s)")
+
+@app.cli.command("write-descriptor")
+@click.option("--output", default="atlassian-connect.json", show_default=True,
+              help="Fichier où écrire le descripteur")
+def write_descriptor_command(output):
+    """Écrit le descripteur Atlassian Connect correspondant à la configuration courante."""
+    with open(output, "wb") as f:
+        f.write(DESCRIPTOR_BYTES)
+    click.echo(f"Descripteur écrit dans {output} (ETag {DESCRIPTOR_ETAG})")
+
 if __name__ == "__main__":
     # Créer le dossier templates s'il n'existe pas
     if not os.path.exists('templates'):
         os.makedirs('templates')
         logger.info("Dossier 'templates' créé")
     
-    # Écrire le fichier de descripteur à jour
-    try:
-        # Utiliser le contexte d'application pour générer le descripteur
-        with app.app_context():
-            # Créer directement le descripteur au lieu d'appeler la route
-            desc_content = descriptor()
-            logger.info("Fichier de descripteur généré avec succès")
-    except Exception as e:
-        logger.error(f"Erreur lors de la génération du fichier de descripteur: {str(e)}")
-    
     port = int(os.environ.get("PORT", 5000))
     logger.info(f"Démarrage du serveur sur le port {port}")
     app.run(host="0.0.0.0", port=port)
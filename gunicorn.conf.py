@@ -0,0 +1,68 @@
+# Configuration gunicorn pour la production (utilisée par render.yaml et le procfile)
+#
+# Les requêtes passent l'essentiel de leur temps à attendre Jira et le modèle : on sert
+# plusieurs requêtes par worker avec des threads, dimensionnés à partir du nombre de CPU
+# et du ratio attente / calcul attendu.
+import math
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+cpu_count = multiprocessing.cpu_count()
+
+# Temps d'attente (Jira, LLM) par unité de temps de calcul pour une requête typique
+io_wait_ratio = float(os.getenv("GUNICORN_IO_WAIT_RATIO", "10"))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# "gthread" par défaut ; "gevent" (pip install gevent) pour un grand nombre de flux SSE ouverts
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+# Les jobs de génération, le regroupement des appels identiques et l'admission LLM vivent dans le
+# processus : sans base de jobs partagée (JOBS_DB_PATH), un job interrogé depuis un autre worker serait
+# introuvable. Un seul worker dans ce cas, les threads couvrant les CPU ; sinon un worker par CPU plus un, borné.
+# WEB_CONCURRENCY, que certains hébergeurs définissent d'office, n'est suivi qu'avec JOBS_DB_PATH.
+if os.getenv("JOBS_DB_PATH"):
+    workers = int(os.getenv("WEB_CONCURRENCY", str(min(cpu_count + 1, int(os.getenv("GUNICORN_MAX_WORKERS", "4"))))))
+else:
+    workers = 1
+
+# Threads nécessaires pour occuper les CPU : cpu * (1 + attente / calcul), répartis entre les workers
+threads = int(os.getenv("GUNICORN_THREADS", str(max(2, math.ceil(cpu_count * (1 + io_wait_ratio) / workers)))))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "200"))
+
+# Une génération complète (file d'attente, continuations, réparation) peut durer jusqu'à GENERATION_DEADLINE,
+# un appel LLM seul jusqu'à LLM_DEADLINE : les timeouts, redémarrage gracieux compris, doivent la laisser se terminer
+generation_deadline = max(float(os.getenv("GENERATION_DEADLINE", "300")), float(os.getenv("LLM_DEADLINE", "180")))
+timeout = int(generation_deadline + 30)
+graceful_timeout = int(generation_deadline + 30)
+keepalive = 5
+
+# Recyclage périodique des workers (fuites mémoire, caches qui grossissent). Sans JOBS_DB_PATH, les jobs
+# vivent dans l'unique worker et les interrogations /api/jobs le feraient recycler en perdant les jobs en
+# cours : pas de recyclage par défaut dans ce cas.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000" if os.getenv("JOBS_DB_PATH") else "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# Charge l'application une fois dans le processus maître avant le fork. Les clients HTTP, threads
+# et pools de l'application sont créés paresseusement par processus, ce qui rend le préchargement sûr.
+# Avec gevent, l'application doit être importée après le monkey-patching du worker : pas de préchargement.
+preload_app = worker_class != "gevent"
+
+# Derrière le proxy de Render : faire confiance aux en-têtes X-Forwarded-*
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "*")
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    server.log.info(f"Démarrage avec {workers} worker(s) {worker_class}, {threads} thread(s) par worker, "
+                    f"timeout {timeout}s")
+    if not os.getenv("JOBS_DB_PATH") and int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        server.log.warning("WEB_CONCURRENCY ignoré : plusieurs workers nécessitent JOBS_DB_PATH "
+                           "pour partager l'état des jobs de génération")
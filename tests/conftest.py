@@ -0,0 +1,14 @@
+import os
+import sys
+
+# Les stores SQLite, la sonde de santé LLM et la pré-génération sont désactivés
+# avant l'import de app pour que les tests n'écrivent rien et ne lancent aucun thread.
+os.environ.setdefault("GENERATION_CACHE_DB", "")
+os.environ.setdefault("GENERATION_HISTORY_DB", "")
+os.environ.setdefault("CONNECT_DB_PATH", "")
+os.environ.setdefault("LLM_HEALTH_INTERVAL", "0")
+os.environ.setdefault("PREGENERATION_ENABLED", "false")
+os.environ.setdefault("JIRA_EMAIL", "tests@example.com")
+os.environ.setdefault("JIRA_API_TOKEN", "test-token")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,125 @@
+"""Tests de l'authentification Atlassian Connect (installation signée et webhooks)"""
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from werkzeug.datastructures import MultiDict
+
+import app
+
+CLIENT_KEY = "client-key-1"
+SHARED_SECRET = "shared-secret-0123456789abcdef0123456789"
+BASE_URL = f"https://{app.JIRA_BASE_URL}"
+
+
+class KeyResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def atlassian_key(monkeypatch):
+    """Clé RSA servie comme clé publique d'installation Atlassian"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode("ascii")
+    monkeypatch.setattr(app.requests, "get", lambda url, **kwargs: KeyResponse(public_pem))
+    return private_key
+
+
+@pytest.fixture
+def installations(monkeypatch, tmp_path):
+    store = app.ConnectInstallations(str(tmp_path / "connect.db"))
+    monkeypatch.setattr(app, "connect_installations", store)
+    return store
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def install_token(private_key, path="/installed", client_key=CLIENT_KEY, audience=None):
+    now = int(time.time())
+    claims = {
+        "iss": client_key,
+        "aud": audience or app.APP_BASE_URL,
+        "iat": now,
+        "exp": now + 60,
+        "qsh": app.connect_query_hash("POST", path, MultiDict()),
+    }
+    return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": "key-1"})
+
+
+def install_payload(secret=SHARED_SECRET, base_url=BASE_URL):
+    return {"clientKey": CLIENT_KEY, "baseUrl": base_url, "sharedSecret": secret}
+
+
+def test_unsigned_install_is_refused(client, installations, atlassian_key):
+    response = client.post("/installed", json=install_payload())
+
+    assert response.status_code == 401
+    assert installations.get(CLIENT_KEY) is None
+
+
+def test_signed_install_stores_the_shared_secret(client, installations, atlassian_key):
+    response = client.post("/installed", json=install_payload(),
+                           headers={"Authorization": f"JWT {install_token(atlassian_key)}"})
+
+    assert response.status_code == 200
+    assert installations.get(CLIENT_KEY)["shared_secret"] == SHARED_SECRET
+
+
+def test_install_signed_by_another_key_is_refused(client, installations, atlassian_key):
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    response = client.post("/installed", json=install_payload(),
+                           headers={"Authorization": f"JWT {install_token(other_key)}"})
+
+    assert response.status_code == 401
+    assert installations.get(CLIENT_KEY) is None
+
+
+def test_install_for_another_app_or_client_is_refused(client, installations, atlassian_key):
+    wrong_audience = install_token(atlassian_key, audience="https://attacker.example.com")
+    wrong_client = install_token(atlassian_key, client_key="other-client")
+    for token in (wrong_audience, wrong_client):
+        response = client.post("/installed", json=install_payload(), headers={"Authorization": f"JWT {token}"})
+        assert response.status_code == 401
+    assert installations.get(CLIENT_KEY) is None
+
+
+def test_install_from_another_jira_instance_is_refused(client, installations, atlassian_key):
+    response = client.post("/installed", json=install_payload(base_url="https://attacker.atlassian.net"),
+                           headers={"Authorization": f"JWT {install_token(atlassian_key)}"})
+
+    assert response.status_code == 403
+
+
+def test_webhook_requires_a_valid_connect_jwt(client, installations, monkeypatch):
+    monkeypatch.setattr(app, "PREGENERATION_ENABLED", False)
+    installations.save(CLIENT_KEY, BASE_URL, SHARED_SECRET)
+    now = int(time.time())
+    claims = {"iss": CLIENT_KEY, "iat": now, "exp": now + 60,
+              "qsh": app.connect_query_hash("POST", "/webhooks/jira", MultiDict())}
+    event = {"webhookEvent": "jira:issue_updated", "issue": {"key": "ACD-1", "fields": {}}}
+
+    assert client.post("/webhooks/jira", json=event).status_code == 401
+    forged = jwt.encode(claims, "x" * 40, algorithm="HS256")
+    assert client.post("/webhooks/jira", json=event,
+                       headers={"Authorization": f"JWT {forged}"}).status_code == 401
+    signed = jwt.encode(claims, SHARED_SECRET, algorithm="HS256")
+    assert client.post("/webhooks/jira", json=event,
+                       headers={"Authorization": f"JWT {signed}"}).status_code == 200
+
+
+def test_bulk_generate_requires_authentication(client, installations, monkeypatch):
+    monkeypatch.setattr(app, "WEBHOOK_SECRET", "s3cret")
+
+    assert client.post("/api/bulk-generate", json={"jql": "project = ACD"}).status_code == 401
+    assert client.post("/api/bulk-generate?secret=wrong", json={"jql": "project = ACD"}).status_code == 401
+    assert client.post("/api/bulk-generate?secret=s3cret", json={}).status_code == 400
@@ -0,0 +1,110 @@
+"""Tests du regroupement des générations identiques (SingleFlight)"""
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition jamais atteinte"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def blocking_model(monkeypatch):
+    """Modèle qui attend le feu vert avant de répondre"""
+    release = threading.Event()
+    calls = []
+
+    def generate_response(prompt, max_tokens=206, messages=None, meta=None):
+        calls.append(messages)
+        assert release.wait(5)
+        meta.update(finish_reason="stop", usage={"prompt_tokens": 10, "completion_tokens": 5}, model="model-b")
+        return "Cas de test 1 : Connexion\nAction : Ouvrir la page\nRésultat attendu : La page s'affiche"
+
+    monkeypatch.setattr(app, "generate_response", generate_response)
+    return release, calls
+
+
+def test_coalesced_caller_receives_the_leader_details(blocking_model):
+    release, calls = blocking_model
+    story = f"En tant qu'utilisateur je veux me connecter ({time.time()})"
+    infos = [{}, {}]
+
+    def run(index):
+        app.run_generation(story, "detailed", "fr", info=infos[index])
+
+    leader = threading.Thread(target=run, args=(0,))
+    leader.start()
+    wait_until(lambda: calls)
+    follower = threading.Thread(target=run, args=(1,))
+    follower.start()
+    time.sleep(0.2)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(calls) == 1
+    assert infos[0]["shared"] is False and infos[1]["shared"] is True
+    for info in infos:
+        assert info["model"] == "model-b"
+        assert info["template"] == app.prompt_registry.get("detailed", "fr").key
+
+
+def test_follower_takes_over_when_the_shared_call_is_cancelled():
+    flight = app.SingleFlight()
+    leader_started, cancel_leader = threading.Event(), threading.Event()
+    results = {}
+
+    def leader_call():
+        leader_started.set()
+        assert cancel_leader.wait(5)
+        raise app.OperationCancelled("Traitement abandonné par le client")
+
+    def leader():
+        with pytest.raises(app.OperationCancelled):
+            flight.do("key", leader_call)
+
+    def follower():
+        with app.deadline_scope(5):
+            results["follower"] = flight.do("key", lambda: "résultat")
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    assert leader_started.wait(5)
+    follower_thread = threading.Thread(target=follower)
+    follower_thread.start()
+    time.sleep(0.1)
+    cancel_leader.set()
+    leader_thread.join(5)
+    follower_thread.join(5)
+
+    # Le suiveur a relancé l'appel à son compte au lieu d'hériter de l'annulation
+    assert results["follower"] == ("résultat", False)
+    assert flight.in_flight() == 0
+
+
+def test_follower_gives_up_at_its_own_deadline():
+    flight = app.SingleFlight()
+    leader_started, release = threading.Event(), threading.Event()
+
+    def leader_call():
+        leader_started.set()
+        assert release.wait(5)
+        return "résultat"
+
+    leader_thread = threading.Thread(target=lambda: flight.do("key", leader_call))
+    leader_thread.start()
+    assert leader_started.wait(5)
+    try:
+        with app.deadline_scope(0.2):
+            with pytest.raises(app.OperationCancelled):
+                flight.do("key", lambda: "jamais appelé")
+    finally:
+        release.set()
+        leader_thread.join(5)
+    assert flight.in_flight() == 0
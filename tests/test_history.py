@@ -0,0 +1,146 @@
+"""Tests de l'historique des générations et de son écriture dans Jira"""
+import pytest
+
+import app
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+        self.text = str(self._payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeJira:
+    """Jira en mémoire : une seule issue, des réponses PUT programmables"""
+
+    def __init__(self, description="User story", updated="2026-01-01T10:00:00.000+0000", put_statuses=()):
+        self.description = description
+        self.updated = updated
+        self.put_statuses = list(put_statuses)
+        self.puts = []
+        self.on_put = None
+
+    def get_issue(self, issue_key, fields=None):
+        return FakeResponse(200, {"fields": {"description": self.description, "updated": self.updated}})
+
+    def update_issue(self, issue_key, fields):
+        self.puts.append(fields["description"])
+        if self.on_put:
+            self.on_put()
+        status = self.put_statuses.pop(0) if self.put_statuses else 204
+        if status in (200, 204):
+            self.description = fields["description"]
+        return FakeResponse(status)
+
+
+@pytest.fixture
+def history(monkeypatch, tmp_path):
+    store = app.GenerationHistory(db_path=str(tmp_path / "history.db"))
+    monkeypatch.setattr(app, "generation_history", store)
+    return store
+
+
+def test_diff_of_versions_without_trailing_newline_is_well_formed(history):
+    history.record("ACD-1", "Feature: A\n  Given x", "gherkin", "fr")
+    history.record("ACD-1", "Feature: B\n  Given y", "gherkin", "fr")
+
+    old, new, diff = history.diff("ACD-1")
+
+    assert (old["version"], new["version"]) == (1, 2)
+    assert diff.splitlines()[2:] == ["@@ -1,2 +1,2 @@", "-Feature: A", "-  Given x", "+Feature: B", "+  Given y"]
+
+
+def test_link_mode_reports_a_failed_link_correction(monkeypatch, history):
+    monkeypatch.setattr(app, "JIRA_STORY_UPDATE_MODE", "link")
+    fake = FakeJira(put_statuses=[204, 500])
+    # Une génération prend le numéro réservé pendant l'écriture dans Jira
+    fake.on_put = lambda: history.record("ACD-1", "Feature: Autre", "gherkin", "fr") if len(fake.puts) == 1 else None
+    monkeypatch.setattr(app, "jira", fake)
+
+    success, message = app.update_jira_story("ACD-1", "Feature: Suite", format_choice="gherkin")
+
+    assert not success
+    assert "version 1" in message
+    assert len(fake.puts) == 2
+    assert fake.description.endswith("/generations/1?format=text")
+    assert history.get("ACD-1", 2)["result"] == "Feature: Suite"
+
+
+def test_link_mode_corrects_the_link_when_the_version_was_taken(monkeypatch, history):
+    monkeypatch.setattr(app, "JIRA_STORY_UPDATE_MODE", "link")
+    fake = FakeJira()
+    fake.on_put = lambda: history.record("ACD-1", "Feature: Autre", "gherkin", "fr") if len(fake.puts) == 1 else None
+    monkeypatch.setattr(app, "jira", fake)
+
+    success, _ = app.update_jira_story("ACD-1", "Feature: Suite", format_choice="gherkin")
+
+    assert success
+    assert fake.description.endswith("/generations/2?format=text")
+
+
+def test_history_closes_its_sqlite_connections(monkeypatch, tmp_path):
+    opened = []
+    connect = app.sqlite3.connect
+
+    class TrackedConnection:
+        def __init__(self, *args, **kwargs):
+            self._conn = connect(*args, **kwargs)
+            self.closed = False
+            opened.append(self)
+
+        def __getattr__(self, name):
+            return getattr(self._conn, name)
+
+        def __enter__(self):
+            return self._conn.__enter__()
+
+        def __exit__(self, *exc):
+            return self._conn.__exit__(*exc)
+
+        def close(self):
+            self.closed = True
+            self._conn.close()
+
+    monkeypatch.setattr(app.sqlite3, "connect", TrackedConnection)
+    store = app.GenerationHistory(db_path=str(tmp_path / "history.db"))
+    store.record("ACD-1", "Feature: A", "gherkin", "fr")
+    store.get("ACD-1")
+    store.versions("ACD-1")
+
+    assert opened and all(conn.closed for conn in opened)
+
+
+def test_version_allocation(history):
+    assert history.next_version("ACD-1", "Feature: A") == 1
+    assert history.record("ACD-1", "Feature: A", "gherkin", "fr") == 1
+    # Un texte déjà enregistré garde son numéro
+    assert history.next_version("ACD-1", "Feature: A") == 1
+    assert history.record("ACD-1", "Feature: A", "gherkin", "fr") == 1
+    assert history.next_version("ACD-1", "Feature: B") == 2
+    # Numéro réservé pris entre-temps : la version suivante est attribuée
+    assert history.record("ACD-1", "Feature: C", "gherkin", "fr", version=2) == 2
+    assert history.record("ACD-1", "Feature: B", "gherkin", "fr", version=2) == 3
+    assert history.next_version("ACD-2", "Feature: A") == 1
+
+
+def test_stale_updated_stamp_is_refused_with_409(monkeypatch, history):
+    fake = FakeJira(updated="2026-01-01T11:00:00.000+0000")
+    monkeypatch.setattr(app, "jira", fake)
+    client = app.app.test_client()
+
+    response = client.post("/update_jira_story", json={
+        "issueKey": "ACD-1", "description": "Feature: Suite", "updated": "2026-01-01T10:00:00.000+0000"})
+
+    assert response.status_code == 409
+    assert response.get_json()["conflict"] is True
+    assert fake.puts == []
+    assert history.get("ACD-1") is None
+
+    response = client.post("/update_jira_story", json={
+        "issueKey": "ACD-1", "description": "Feature: Suite", "updated": fake.updated})
+    assert response.status_code == 200
+    assert len(fake.puts) == 1
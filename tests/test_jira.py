@@ -0,0 +1,94 @@
+"""Tests des échanges avec Jira : tickets de test en masse et descripteur Connect"""
+import app
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+        self.text = str(self._payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeBulkJira:
+    """issue/bulk programmable : une réponse par appel, les lots reçus sont conservés"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.chunks = []
+
+    def create_issues_bulk(self, issue_updates):
+        self.chunks.append(issue_updates)
+        return self.responses.pop(0)
+
+
+FEATURE = """Feature: Panier
+Scenario: Ajout
+  Given a cart
+  Then the cart contains one item
+Scenario: Retrait
+  Given a cart with one item
+  Then the cart is empty
+Scenario: Vidage
+  Given a cart with two items
+  Then the cart is empty
+"""
+
+
+def test_create_test_issues_chunks_and_maps_results(monkeypatch):
+    monkeypatch.setattr(app, "JIRA_BULK_CREATE_SIZE", 2)
+    fake = FakeBulkJira([
+        FakeResponse(201, {"issues": [{"key": "ACD-10"}, {"key": "ACD-11"}], "errors": []}),
+        FakeResponse(400, {"issues": [], "errors": [{
+            "failedElementNumber": 0, "status": 400,
+            "elementErrors": {"errorMessages": [], "errors": {"issuetype": "Type inconnu"}}}]}),
+    ])
+    monkeypatch.setattr(app, "jira", fake)
+
+    created, errors = app.create_test_issues("ACD-1", app.parse_gherkin(FEATURE))
+
+    assert [len(chunk) for chunk in fake.chunks] == [2, 1]
+    assert created == [{"key": "ACD-10", "summary": "Ajout"}, {"key": "ACD-11", "summary": "Retrait"}]
+    assert errors == [{"summary": "Vidage", "error": "issuetype: Type inconnu"}]
+
+
+def test_created_test_issues_are_linked_to_the_story(monkeypatch):
+    fake = FakeBulkJira([FakeResponse(201, {"issues": [{"key": "ACD-10"}, {"key": "ACD-11"}, {"key": "ACD-12"}]})])
+    monkeypatch.setattr(app, "jira", fake)
+
+    app.create_test_issues("ACD-1", app.parse_gherkin(FEATURE), issue_type="Test")
+
+    for update in fake.chunks[0]:
+        assert update["fields"]["project"]["key"] == "ACD"
+        assert update["fields"]["issuetype"]["name"] == "Test"
+        link = update["update"]["issuelinks"][0]["add"]
+        assert link["type"]["name"] == app.TEST_LINK_TYPE
+        assert link["outwardIssue"]["key"] == "ACD-1"
+
+
+def test_skipped_elements_are_reported_when_jira_returns_fewer_issues(monkeypatch):
+    fake = FakeBulkJira([FakeResponse(500, {})])
+    monkeypatch.setattr(app, "jira", fake)
+
+    created, errors = app.create_test_issues("ACD-1", app.parse_gherkin(FEATURE))
+
+    assert created == []
+    assert [error["error"] for error in errors] == ["Non créé (500)"] * 3
+
+
+def test_descriptor_is_served_with_an_etag_and_304_when_unchanged():
+    client = app.app.test_client()
+
+    first = client.get("/atlassian-connect.json")
+    assert first.status_code == 200
+    assert first.headers["ETag"] == f'"{app.DESCRIPTOR_ETAG}"'
+    assert first.get_json()["key"] == "com.amaniconsulting.qalilab-ai"
+
+    again = client.get("/atlassian-connect.json", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.data == b""
+
+    changed = client.get("/atlassian-connect.json", headers={"If-None-Match": '"autre-version"'})
+    assert changed.status_code == 200
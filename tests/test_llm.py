@@ -0,0 +1,160 @@
+"""Tests de l'appel aux backends LLM : bascule, disjoncteur et admission"""
+import threading
+import time
+
+import pytest
+import requests
+
+import app
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {"choices": [{"message": {"content": "ok"}, "finish_reason": "stop"}]}
+        self.text = str(self._payload)
+
+    def json(self):
+        return self._payload
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    """Deux backends sains, sans sondage de santé ni attente entre les essais"""
+    primary = app.LLMBackend("http://primary/v1/chat/completions", "model-a")
+    secondary = app.LLMBackend("http://secondary/v1/chat/completions", "model-b")
+    # Le backend principal est choisi en premier (latence mesurée plus faible)
+    primary.avg_latency, secondary.avg_latency = 1.0, 2.0
+    monkeypatch.setattr(app, "llm_router", app.LLMRouter([primary, secondary], health_interval=0))
+    monkeypatch.setattr(app, "LLM_RETRY_BASE_DELAY", 0)
+    return primary, secondary
+
+
+def test_read_timeout_fails_over_to_another_backend(monkeypatch, backends):
+    primary, secondary = backends
+    calls = []
+
+    def post(url, timeout=None, **kwargs):
+        calls.append((url, timeout))
+        if url == primary.url:
+            raise requests.exceptions.ReadTimeout("backend saturé")
+        return FakeResponse()
+
+    monkeypatch.setattr(app.requests, "post", post)
+
+    with app.llm_request({"messages": []}) as response:
+        assert response.status_code == 200
+        assert response.llm_model == "model-b"
+
+    assert [url for url, _ in calls] == [primary.url, secondary.url]
+    # Le premier backend n'a reçu qu'une part du délai pour laisser le temps de basculer
+    assert calls[0][1][1] <= app.LLM_DEADLINE / 2 + 1
+    assert primary.breaker.stats()["consecutive_failures"] == 1
+    assert primary.in_flight == secondary.in_flight == 0
+
+
+def test_retryable_status_fails_over_and_open_circuit_is_skipped(monkeypatch, backends):
+    primary, secondary = backends
+    monkeypatch.setattr(primary.breaker, "failure_threshold", 1)
+    calls = []
+
+    def post(url, **kwargs):
+        calls.append(url)
+        return FakeResponse(503 if url == primary.url else 200)
+
+    monkeypatch.setattr(app.requests, "post", post)
+
+    with app.llm_request({"messages": []}) as response:
+        assert response.status_code == 200
+    assert calls == [primary.url, secondary.url]
+    assert primary.breaker.state == "open"
+
+    # Circuit ouvert : le backend principal n'est plus essayé
+    with app.llm_request({"messages": []}) as response:
+        assert response.llm_model == "model-b"
+    assert calls == [primary.url, secondary.url, secondary.url]
+
+
+def test_half_open_breaker_allows_a_single_probe(monkeypatch):
+    breaker = app.CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    # Délai de réarmement écoulé : un seul appel de test à la fois
+    monkeypatch.setattr(breaker, "_opened_at", breaker._opened_at - 31)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+    # Appel de test en échec : le circuit se rouvre aussitôt
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    monkeypatch.setattr(breaker, "_opened_at", breaker._opened_at - 31)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_admission_rejects_when_the_queue_is_full():
+    admission = app.AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=5)
+
+    with admission.slot():
+        with pytest.raises(app.LLMOverloaded) as excinfo:
+            with admission.slot():
+                pass
+        with pytest.raises(app.LLMOverloaded):
+            admission.check_capacity()
+    assert excinfo.value.retry_after >= 1
+    assert admission.stats()["rejected_total"] == 2
+    assert admission.stats()["active"] == 0
+
+
+def test_admission_rejects_after_the_queue_timeout():
+    admission = app.AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.2)
+
+    with admission.slot():
+        started = time.time()
+        with pytest.raises(app.LLMOverloaded):
+            with admission.slot():
+                pass
+        assert time.time() - started >= 0.2
+    stats = admission.stats()
+    assert (stats["waiting"], stats["rejected_total"]) == (0, 1)
+
+
+def test_admission_reports_a_spent_deadline_as_cancellation():
+    admission = app.AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+
+    with admission.slot():
+        with app.deadline_scope(0.2):
+            with pytest.raises(app.OperationCancelled):
+                with admission.slot():
+                    pass
+    assert admission.stats()["rejected_total"] == 0
+
+
+def test_queued_call_is_admitted_when_a_slot_frees_up():
+    admission = app.AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+    admitted = threading.Event()
+
+    def queued():
+        with admission.slot():
+            admitted.set()
+
+    with admission.slot():
+        thread = threading.Thread(target=queued)
+        thread.start()
+        time.sleep(0.1)
+        assert admission.stats()["waiting"] == 1
+        assert not admitted.is_set()
+    thread.join(5)
+    assert admitted.is_set()
@@ -0,0 +1,232 @@
+"""Tests du parsing et de la réparation des cas de test générés (Gherkin et Actions)"""
+import app
+
+
+FRENCH_GHERKIN = """Fonctionnalité: Connexion utilisateur
+
+Scénario: Connexion réussie
+  Étant donné un utilisateur inscrit
+  Quand il saisit ses identifiants
+  Alors il accède au tableau de bord
+"""
+
+OUTLINE_GHERKIN = """```gherkin
+@smoke
+Feature: Panier
+
+Background:
+  Given a logged-in customer
+
+Scenario Outline: Add an item
+  Given an empty cart
+  When the customer adds <quantity> items
+  Then the cart contains <quantity> items
+
+  Examples:
+    | quantity |
+    | 1        |
+    | 3        |
+
+Scenario: Bulk import
+  Given the following products:
+    | name  | price |
+    | Pen   | 2     |
+  Then the catalog lists 1 product
+```
+"""
+
+
+def test_parse_gherkin_french_keywords():
+    feature = app.parse_gherkin(FRENCH_GHERKIN)
+
+    assert feature.title == "Connexion utilisateur"
+    assert len(feature.scenarios) == 1
+    scenario = feature.scenarios[0]
+    assert scenario.title == "Connexion réussie"
+    assert scenario.keyword == "Scenario"
+    assert [step.keyword for step in scenario.steps] == ["Étant donné", "Quand", "Alors"]
+    assert scenario.steps[0].text == "un utilisateur inscrit"
+
+
+def test_french_steps_are_exported_with_english_keywords():
+    feature_file = app.parse_gherkin(FRENCH_GHERKIN).to_feature_file()
+
+    assert "Given un utilisateur inscrit" in feature_file
+    assert "When il saisit ses identifiants" in feature_file
+    assert "Then il accède au tableau de bord" in feature_file
+
+
+def test_parse_gherkin_background_outline_and_examples():
+    feature = app.parse_gherkin(OUTLINE_GHERKIN)
+
+    assert feature.title == "Panier"
+    assert [step.text for step in feature.background] == ["a logged-in customer"]
+    outline, bulk = feature.scenarios
+    assert outline.keyword == "Scenario Outline"
+    assert len(outline.steps) == 3
+    assert len(outline.examples) == 3
+    assert "quantity" in outline.examples[0]
+    # Une table hors Examples est rattachée à l'étape qui la précède
+    assert bulk.keyword == "Scenario"
+    assert "| Pen" in bulk.steps[0].text
+    assert bulk.steps[1].text == "the catalog lists 1 product"
+
+
+def test_valid_gherkin_has_no_problem():
+    assert app.validate_gherkin(FRENCH_GHERKIN) == []
+    assert app.validate_gherkin(OUTLINE_GHERKIN) == []
+
+
+def test_orphan_steps_are_reported_and_wrapped_in_a_scenario():
+    text = """Feature: Recherche
+Given a catalog
+When the user searches "pen"
+Then one result is shown
+"""
+    assert "etapes_hors_scenario" in app.validate_gherkin(text)
+
+    repaired = app.repair_gherkin(text)
+    assert "Scénario 1" in repaired
+    assert app.validate_gherkin(repaired) == []
+    feature = app.parse_gherkin(repaired)
+    assert len(feature.scenarios) == 1
+    assert len(feature.scenarios[0].steps) == 3
+
+
+def test_duplicate_titles_are_reported_and_suffixed():
+    text = """Feature: Paiement
+Scenario: Paiement par carte
+  Given a cart
+  Then payment succeeds
+Scenario: Paiement par carte
+  Given a cart
+  Then payment is refused
+"""
+    assert "titres_dupliques" in app.validate_gherkin(text)
+
+    repaired = app.repair_gherkin(text)
+    titles = [scenario.title for scenario in app.parse_gherkin(repaired).scenarios]
+    assert titles == ["Paiement par carte", "Paiement par carte (2)"]
+    assert app.validate_gherkin(repaired) == []
+
+
+def test_empty_scenarios_are_reported_and_dropped():
+    text = """Feature: Profil
+Scenario: Sans étape
+Scenario: Modifier le nom
+  Given a profile
+  Then the name is updated
+"""
+    assert "scenario_vide" in app.validate_gherkin(text)
+    assert [s.title for s in app.parse_gherkin(text).scenarios] == ["Modifier le nom"]
+
+    repaired = app.repair_gherkin(text)
+    assert "Sans étape" not in repaired
+    assert app.validate_gherkin(repaired) == []
+
+
+def test_missing_feature_uses_fallback_title():
+    text = """Scenario: Déconnexion
+  Given a session
+  Then the session is closed
+"""
+    assert app.validate_gherkin(text) == ["feature_manquante"]
+    repaired = app.repair_gherkin(text, fallback_title="Gestion des sessions")
+    assert repaired.startswith("Feature: Gestion des sessions")
+
+
+def test_text_without_gherkin_is_not_repaired():
+    assert "aucun_scenario" in app.validate_gherkin("Désolé, je ne peux pas répondre.")
+
+
+def test_parse_actions_markdown_table():
+    text = """Cas de test 1 : Création de compte
+
+| N° | Action | Résultat attendu |
+|----|--------|------------------|
+| 1 | Ouvrir la page d'inscription | Le formulaire s'affiche |
+| 2 | **Valider** le formulaire | Le compte est créé |
+"""
+    feature = app.parse_action_steps(text)
+
+    assert len(feature.scenarios) == 1
+    scenario = feature.scenarios[0]
+    assert scenario.title == "Création de compte"
+    assert scenario.keyword == "Test"
+    assert [(step.text, step.expected) for step in scenario.steps] == [
+        ("Ouvrir la page d'inscription", "Le formulaire s'affiche"),
+        ("Valider le formulaire", "Le compte est créé"),
+    ]
+
+
+def test_parse_actions_numbered_steps_and_expected_results():
+    text = """Cas de test 1 : Connexion
+1. Ouvrir la page de connexion
+Résultat attendu : La page s'affiche
+2) Saisir un mot de passe erroné
+Résultat attendu : Un message d'erreur apparaît
+
+Cas de test 2 : Déconnexion
+Action : Cliquer sur "Se déconnecter"
+Résultat attendu : L'utilisateur est redirigé vers l'accueil
+"""
+    feature = app.parse_test_cases(text, "actions")
+
+    login, logout = feature.scenarios
+    assert login.title == "Connexion"
+    assert len(login.steps) == 2
+    assert login.steps[0].expected == "La page s'affiche"
+    assert login.steps[1].expected == "Un message d'erreur apparaît"
+    assert logout.title == "Déconnexion"
+    assert logout.steps[0].text == 'Cliquer sur "Se déconnecter"'
+    assert logout.steps[0].expected == "L'utilisateur est redirigé vers l'accueil"
+
+
+def test_drop_incomplete_tail_removes_truncated_last_line():
+    truncated = "Scenario: Panier\n  Given a cart\n  Then the to"
+    assert app._drop_incomplete_tail(truncated) == "Scenario: Panier\n  Given a cart\n"
+    complete = "Scenario: Panier\n  Given a cart\n"
+    assert app._drop_incomplete_tail(complete) == complete
+
+
+def test_truncated_generation_is_trimmed_when_continuation_fails(monkeypatch):
+    monkeypatch.setattr(app, "continue_generation", lambda *args, **kwargs: None)
+    result = """Feature: Panier
+Scenario: Ajout
+  Given a cart
+  Then the cart contains one item
+Scenario: Retrait
+  Given a cart with one item
+  When the customer remo"""
+
+    finalized = app.finalize_generation([], result, "gherkin", truncated=True)
+
+    assert "remo" not in finalized
+    assert app.validate_gherkin(finalized) == []
+    titles = [scenario.title for scenario in app.parse_gherkin(finalized).scenarios]
+    assert titles == ["Ajout", "Retrait"]
+
+
+def test_stitch_continuation_removes_repeated_overlap():
+    partial = "Scenario: Ajout\n  Given a cart\n  When the customer adds"
+    continuation = "the customer adds an item\n  Then the cart contains one item\n"
+    stitched = app._stitch_continuation(partial, continuation)
+    assert stitched == ("Scenario: Ajout\n  Given a cart\n  When the customer adds an item\n"
+                        "  Then the cart contains one item\n")
+
+
+def test_continuation_is_requested_in_the_template_language(monkeypatch):
+    instructions = []
+
+    def continue_generation(messages, partial, max_tokens, on_delta=None, meta=None, instruction=None):
+        instructions.append(instruction)
+        return partial + "ne item\n"
+
+    monkeypatch.setattr(app, "continue_generation", continue_generation)
+    template = app.prompt_registry.get("gherkin", "en")
+    truncated = "Feature: Cart\nScenario: Add\n  Given a cart\n  Then the cart contains o"
+
+    finalized = app.finalize_generation([], truncated, "gherkin", truncated=True, template=template)
+
+    assert instructions == [app.CONTINUATION_INSTRUCTIONS_EN]
+    assert finalized.endswith("Then the cart contains one item\n")